@@ -13,18 +13,26 @@
        when the client still running, client will receive a broadcast: SERVER_SHUTDOWN: CONNECTION CLOSE.
 #   5. The client will output a log file ({id}.log) whenever it receive or send message to server except the heartbeat
        message because heartbeat message is meaningless.
+#   6. Library use: DNSClient(..., cache=ClientCache()).lookup(domain, method) returns the parsed response at once and
+       keeps answers for the TTL sent by the server (dns_common/client_cache.py), so a name asked again is answered from
+       memory. Concurrent lookups of one name send one query. Do not run the receive thread of the interactive client
+       at the same time.
 """
 
 
 import os
+import sys
 import time
 import socket
 import threading
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common import codec
+
 
 class DNSClient:
 
-    def __init__(self, id_, ip_, port_):
+    def __init__(self, id_, ip_, port_, cache=None):
         self.id = id_
 
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -36,17 +44,40 @@ class DNSClient:
         self.server_online = True
 
         self.log_dir = './log/{0}.log'.format(self.id)
+        self.encoder = codec.MessageEncoder(self.id)
+
+        '''Library use: one query at a time on the socket, answers kept in the optional ClientCache'''
+        self.cache = cache
+        self.socket_lock = threading.Lock()
 
     def send_query(self, domain, method):
         """query format: <id, hostname, I/R>"""
 
-        query = '<{0}, {1}, {2}>'.format(self.id, domain, method)
-        self.client_socket.sendall(bytes(query, encoding="utf-8"))
-        self.write_log(query[1:-1] + '\n')
+        query = self.encoder.query(domain, method)
+        self.client_socket.sendall(query)
+        self.write_log(codec.log_line(query))
 
         self.msg_sent = True
         return None
 
+    def lookup(self, domain, method='I'):
+        """Return the parsed response (code, id, value[, ttl]) of domain, from the cache if it has a fresh one."""
+        if self.cache is None:
+            return self.ask(domain, method)
+        return self.cache.lookup(domain, lambda: self.ask(domain, method))
+
+    def ask(self, domain, method):
+        query = self.encoder.query(domain, method)
+        with self.socket_lock:
+            self.client_socket.sendall(query)
+            response = self.client_socket.recv(1024)
+        self.write_log(codec.log_line(query))
+        self.write_log(codec.log_line(response) + '\n')
+        return codec.parse_response(response)
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else {}
+
     def recv_msg(self):
         recv_bytes = self.client_socket.recv(1024)
         recv_str = str(recv_bytes, encoding="utf-8")
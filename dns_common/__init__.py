@@ -0,0 +1,9 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: __init__.py
+# description:
+#   Code shared by the client, the local default server, the root DNS server and the TLS DNS servers. Every script is
+    run from its own directory, so it appends the parent directory to sys.path before importing dns_common.
+"""
@@ -0,0 +1,127 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: bench_codec.py
+# description:
+#   1. Microbenchmarks of the message codec (codec.py). Every case runs the old str based code, which was copied in all
+       servers and the client, and the codec, and prints messages per second of both.
+#   2. Usage: python bench_codec.py [n_messages]
+"""
+
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common import codec
+
+
+SERVER_ID = 'Local_DNS_Server'
+QUERY = b'<PC1, www.proficiency.teachscape.com, I>'
+RESPONSE = b'<0x00, COM_DNS_Server, 69.36.226.168>'
+REFERRAL = b'<0x01, Root_DNS_Server, 127.0.0.1, 5678>'
+IP = '69.36.226.168'
+
+
+def old_parse_query(data):
+    query = str(data, encoding='utf-8')
+    query_list = query[1:-1].split(',')
+    if len(query_list) != 3:
+        return None
+    return query_list[0].strip(), query_list[1].strip(), query_list[2].strip()
+
+
+def old_parse_response(data):
+    response_msg = str(data, encoding='utf-8')
+    response_msg_list = response_msg[1:-1].split(',')
+    return [field.strip() for field in response_msg_list]
+
+
+def old_encode_answer(ip):
+    send_msg = "<0x00, {0}, {1}>".format(SERVER_ID, ip)
+    return bytes(send_msg, encoding="utf-8")
+
+
+def old_encode_query(domain, method):
+    send_msg = "<{0}, {1}, {2}>".format(SERVER_ID, domain, method)
+    return bytes(send_msg, encoding="utf-8")
+
+
+def old_hit_hop(data):
+    '''What the local server did for a cache hit: decode, log, parse, check, encode, log.'''
+    query_ = str(data, encoding='utf-8')
+    log_in = query_[1:-1] + '\n'
+    query_list = query_[1:-1].split(',')
+    domain = query_list[1].strip()
+    method = query_list[2].strip()
+    valid = domain.split('.')[-1].strip() in ('com', 'gov', 'org') and method in ('R', 'I')
+    send_msg = "<0x00, {0}, {1}>".format(SERVER_ID, IP)
+    send_bytes = bytes(send_msg, encoding="utf-8")
+    log_out = send_msg[1:-1] + '\n'
+    return log_in, valid, send_bytes, log_out
+
+
+def new_hit_hop(data, encoder, cache):
+    '''The same with the codec: decode once, then log and parse the same text.'''
+    text = codec.decode(data)
+    log_in = codec.log_line(text)
+    client, domain, method, trace_id = codec.parse_query(text, cache)
+    valid = domain.split('.')[-1] in ('com', 'gov', 'org') and method in ('R', 'I')
+    send_msg = encoder.answer(IP)
+    log_out = codec.log_line(send_msg)
+    return log_in, valid, send_msg, log_out
+
+
+def rate(function, args, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        function(*args)
+    return n / (time.perf_counter() - start)
+
+
+def rate_distinct(function, messages, *args):
+    '''Every message is different, so a parse cache only misses and churns.'''
+    start = time.perf_counter()
+    for message in messages:
+        function(message, *args)
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main(n=200000):
+    encoder = codec.MessageEncoder(SERVER_ID)
+    view = memoryview(QUERY)
+    messages = [bytes('<PC1, www.host{0}.com, I>'.format(i), encoding='utf-8') for i in range(n)]
+    cache = codec.ParseCache()
+    cases = [('parse query', (old_parse_query, (QUERY,)), (codec.parse_query, (QUERY,))),
+             ('parse query (local cache)', (old_parse_query, (QUERY,)), (codec.parse_query, (QUERY, cache))),
+             ('parse query (memoryview)', (old_parse_query, (view,)), (codec.parse_query, (view,))),
+             ('parse response', (old_parse_response, (RESPONSE,)), (codec.parse_response, (RESPONSE,))),
+             ('parse referral', (old_parse_response, (REFERRAL,)), (codec.parse_response, (REFERRAL,))),
+             ('encode answer', (old_encode_answer, (IP,)), (encoder.answer, (IP,))),
+             ('encode not found', (lambda: bytes("<0xFF, {0}, {1}>".format(SERVER_ID, "Host not found"),
+                                                 encoding="utf-8"), ()), (encoder.not_found, ())),
+             ('encode query', (old_encode_query, ('www.google.com', 'I')), (encoder.query, ('www.google.com', 'I'))),
+             ('cache hit hop', (old_hit_hop, (QUERY,)), (new_hit_hop, (QUERY, encoder, cache))),
+             ]
+
+    print('{0:<30} {1:>14} {2:>14} {3:>8}'.format('case', 'old msg/s', 'codec msg/s', 'speedup'))
+    for name, (old_function, old_args), (new_function, new_args) in cases:
+        old_rate = rate(old_function, old_args, n)
+        new_rate = rate(new_function, new_args, n)
+        print('{0:<30} {1:>14,.0f} {2:>14,.0f} {3:>7.2f}x'.format(name, old_rate, new_rate, new_rate / old_rate))
+
+    distinct = [('parse query (all different)', old_parse_query, (codec.parse_query,)),
+                ('parse (all diff, local cache)', old_parse_query, (codec.parse_query, codec.ParseCache())),
+                ('cache hit hop (all different)', old_hit_hop, (new_hit_hop, encoder, codec.ParseCache())),
+                ]
+    for name, old_function, (new_function, *new_args) in distinct:
+        old_rate = rate_distinct(old_function, messages)
+        new_rate = rate_distinct(new_function, messages, *new_args)
+        print('{0:<30} {1:>14,.0f} {2:>14,.0f} {3:>7.2f}x'.format(name, old_rate, new_rate, new_rate / old_rate))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
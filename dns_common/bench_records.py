@@ -0,0 +1,72 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: bench_records.py
+# description:
+#   1. Memory benchmark of the record storage (records.py). For every size it fills a dict of str (the old zone
+       database) and a RecordTable with the same records (1 in 100 an IPv6 address) and prints the bytes per record of
+       both, the time to fill them and the lookups per second.
+#   2. Bytes are counted with sys.getsizeof: the dict and all its key and value strings, and the arena, columns and
+       index of the table.
+#   3. Usage: python bench_records.py [n_records ...], default 1000000 10000000 (the 10M dict needs about 2 GB).
+"""
+
+
+import os
+import sys
+import time
+import random
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common.records import RecordTable
+
+
+def record(i):
+    name = 'host{0}.zone{1}.com'.format(i, i % 1000)
+    if i % 100 == 0:
+        return name, '2001:db8::{0:x}:{1:x}'.format(i >> 16, i & 0xFFFF)
+    return name, '10.{0}.{1}.{2}'.format((i >> 16) & 255, (i >> 8) & 255, i & 255)
+
+
+def dict_bytes(records):
+    return sys.getsizeof(records) + sum(sys.getsizeof(name) + sys.getsizeof(ip) for name, ip in records.items())
+
+
+def lookup_rate(table, names):
+    start = time.perf_counter()
+    for name in names:
+        table.get(name)
+    return len(names) / (time.perf_counter() - start)
+
+
+def measure(kind, n, names):
+    start = time.perf_counter()
+    if kind == 'dict of str':
+        table = {}
+    else:
+        table = RecordTable()
+    for i in range(n):
+        name, ip = record(i)
+        table[name] = ip
+    fill = time.perf_counter() - start
+
+    size = dict_bytes(table) if kind == 'dict of str' else table.nbytes()
+    rate = lookup_rate(table, names)
+    return '{0:>11,} {1:<12} {2:>10.1f} {3:>12.1f} {4:>14,.0f}'.format(n, kind, size / n, fill, rate)
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or [1000000, 10000000]
+    print('{0:>11} {1:<12} {2:>10} {3:>12} {4:>14}'.format('records', 'storage', 'bytes/rec', 'fill s', 'lookups/s'))
+    for n in sizes:
+        random.seed(n)
+        names = [record(random.randrange(n))[0] for _ in range(100000)]
+        for kind in ('dict of str', 'RecordTable'):
+            print(measure(kind, n, names))
+            sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
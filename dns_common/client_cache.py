@@ -0,0 +1,109 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: client_cache.py
+# description:
+#   1. In-process cache of a DNS client (DNSClient, lookup.Resolver). A process which asks for the same names again and
+       again gets them from memory instead of asking the local server every time.
+#   2. An answer is kept for the TTL the local server sent with it (<0x00, {id}, ip, ttl>), at most max_ttl seconds.
+       An answer with TTL 0 (a stale answer of the server) is not kept. "Host not found" is kept negative_ttl seconds;
+       busy, invalid and truncated responses are never kept.
+#   3. At most max_entries names are kept. When the cache is full the least recently used name is evicted.
+#   4. Concurrent lookups of a name which is not cached are coalesced: the first one asks the server, the others wait
+       for its answer, so a burst of threads asking for one name sends one query.
+#   5. hits, misses (queries sent), coalesced and evictions are counted, see stats().
+"""
+
+
+import time
+import threading
+import collections
+
+from dns_common import codec
+
+
+class ClientCache:
+
+    def __init__(self, max_entries=1024, max_ttl=3600, negative_ttl=30):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+
+        '''entries: formatted as OrderedDict({name: (expire time, response)}), the least recently used first'''
+        self.entries = collections.OrderedDict()
+        '''pending: formatted as {name: {'done': Event, 'response': parsed response}} of the lookups in flight'''
+        self.pending = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def lookup(self, name, fetch):
+        """Return the cached response of name, or the one of fetch() called once for all concurrent lookups.
+        The waiting lookups get None if fetch() raised."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(name)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[name]
+
+            waiting = self.pending.get(name)
+            if waiting is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                self.pending[name] = lookup = {'done': threading.Event(), 'response': None}
+
+        if waiting is not None:
+            waiting['done'].wait()
+            return waiting['response']
+
+        try:
+            lookup['response'] = fetch()
+            self.store(name, lookup['response'])
+        finally:
+            with self.lock:
+                del self.pending[name]
+            lookup['done'].set()
+        return lookup['response']
+
+    def ttl(self, response):
+        """Return the seconds response may be kept, 0 if it must not be kept."""
+        if response is None:
+            return 0
+        if response[0] == codec.CODE_OK:
+            ttl = codec.parse_ttl(response)
+            return min(ttl, self.max_ttl) if ttl is not None else 0
+        if response[0] == codec.CODE_NOT_FOUND:
+            return self.negative_ttl
+        return 0
+
+    def store(self, name, response):
+        ttl = self.ttl(response)
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[name] = (time.monotonic() + ttl, response)
+            self.entries.move_to_end(name)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                }
@@ -0,0 +1,158 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: lookup.py
+# description:
+#   1. One-shot lookups for short-lived clients. A query is sent to the local server as a single UDP datagram, which
+       needs no handshake and no session on the server.
+#   2. The client falls back to TCP when the answer is truncated (<0xFC, ...>: too large for one datagram) or when no
+       datagram comes back after udp_retries tries of udp_timeout seconds (UDP may lose packets).
+#   3. Usage: python lookup.py {domain} [I|R] [--server 127.0.0.1:5352] [--tcp]
+       python lookup.py {domain} [I|R] --bench {n} compares the latency of n lookups over UDP and over a new TCP
+       connection per lookup, and n lookups through a client cache (client_cache.py), which asks the server once.
+       Only 0x00 answers are timed; other answers are counted by code, and the bench fails (exit code 1) when they
+       are the most. The local server rate limits each client address, so start it with --rate 0 for benchmarks.
+#   4. Resolver(cache=ClientCache()) keeps answers for the TTL sent by the server.
+"""
+
+
+import os
+import sys
+import time
+import socket
+import argparse
+import collections
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common import codec
+from dns_common.client_cache import ClientCache
+from dns_common.querylog import LatencyHistogram
+
+
+LOCAL_SERVER = ('127.0.0.1', 5352)
+
+
+class Resolver:
+
+    def __init__(self, id_='PC_UDP', server=LOCAL_SERVER, udp_timeout=1.0, udp_retries=2, tcp_timeout=10.0,
+                 cache=None):
+        self.id = id_
+        self.server = server
+        self.udp_timeout = udp_timeout
+        self.udp_retries = udp_retries
+        self.tcp_timeout = tcp_timeout
+        self.msg_size = 64 * 1024
+        self.encoder = codec.MessageEncoder(self.id)
+        self.cache = cache
+
+        '''counters of the transport which answered'''
+        self.udp_answers = 0
+        self.tcp_fallbacks = 0
+
+    def lookup(self, domain, method='I'):
+        """Return the parsed response (code, id, value[, ttl]) over UDP, or over TCP if UDP cannot answer."""
+        if self.cache is not None:
+            return self.cache.lookup(domain, lambda: self.lookup_server(domain, method))
+        return self.lookup_server(domain, method)
+
+    def lookup_server(self, domain, method='I'):
+        query = self.encoder.query(domain, method)
+        response = self.lookup_udp(query)
+        if response is not None and response[0] != codec.CODE_TRUNCATED:
+            self.udp_answers += 1
+            return response
+        self.tcp_fallbacks += 1
+        return self.lookup_tcp(query)
+
+    def lookup_udp(self, query):
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.settimeout(self.udp_timeout)
+        try:
+            for _ in range(self.udp_retries):
+                udp_socket.sendto(query, self.server)
+                try:
+                    data, address = udp_socket.recvfrom(self.msg_size)
+                except socket.timeout:
+                    continue
+                response = codec.parse_response(data)
+                if response is not None:
+                    return response
+        except OSError:
+            pass
+        finally:
+            udp_socket.close()
+        return None
+
+    def lookup_tcp(self, query):
+        connection = socket.create_connection(self.server, timeout=self.tcp_timeout)
+        try:
+            connection.sendall(query)
+            response = codec.parse_response(connection.recv(self.msg_size))
+            connection.sendall(b'q')
+        finally:
+            connection.close()
+        return response
+
+
+def bench(resolver, domain, method, n):
+    """Return (report, failed). Only 0x00 answers are timed; the other answers are counted by code, and the bench
+    failed if they are the most of a row (e.g. 0xFE from the rate limit of the server)."""
+    query = resolver.encoder.query(domain, method)
+    cached = Resolver(server=resolver.server, cache=ClientCache())
+    lines = []
+    failed = False
+    for name, function, args in (('udp', resolver.lookup_udp, (query,)), ('tcp', resolver.lookup_tcp, (query,)),
+                                 ('cached', cached.lookup, (domain, method))):
+        histogram = LatencyHistogram()
+        codes = collections.Counter()
+        for _ in range(n):
+            start = time.perf_counter()
+            response = function(*args)
+            elapsed = (time.perf_counter() - start) * 1000
+            code = response[0] if response is not None else 'none'
+            codes[code] += 1
+            if code == codec.CODE_OK:
+                histogram.add(elapsed)
+        others = ', '.join('{0}={1}'.format(code, count) for code, count in sorted(codes.items())
+                           if code != codec.CODE_OK)
+        lines.append('{0:<6}  ok {1}/{2}  mean {3:.3f}  p50 {4:.3f}  p99 {5:.3f} ms{6}'.format(
+            name, codes[codec.CODE_OK], n, histogram.mean(), histogram.percentile(50), histogram.percentile(99),
+            '  not ok: ' + others if others else ''))
+        failed = failed or codes[codec.CODE_OK] * 2 < n
+    lines.append('cache  ' + ', '.join('{0}={1}'.format(key, value) for key, value in cached.cache.stats().items()))
+    if failed:
+        lines.append('FAIL: most answers were not 0x00, the times above are not lookups. If they are 0xFE, start the '
+                     'local server with --rate 0.')
+    return '\n'.join(lines), failed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Look up one name over UDP with TCP fallback.')
+    parser.add_argument('domain')
+    parser.add_argument('method', nargs='?', default='I', choices=['I', 'R'])
+    parser.add_argument('--server', default='127.0.0.1:5352')
+    parser.add_argument('--tcp', action='store_true', help='skip UDP')
+    parser.add_argument('--bench', type=int, default=0, help='compare n lookups over UDP and TCP')
+    args = parser.parse_args(argv)
+
+    host, port = args.server.rsplit(':', 1)
+    resolver = Resolver(server=(host, int(port)))
+    if args.bench:
+        report, failed = bench(resolver, args.domain, args.method, args.bench)
+        print(report)
+        return 1 if failed else 0
+
+    if args.tcp:
+        response = resolver.lookup_tcp(resolver.encoder.query(args.domain, args.method))
+    else:
+        response = resolver.lookup(args.domain, args.method)
+    if response is None:
+        print('no response')
+        return 1
+    print('{0} {1} ({2})'.format(response[0], response[2], 'tcp' if args.tcp or resolver.tcp_fallbacks else 'udp'))
+    return 0 if response[0] == codec.CODE_OK else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
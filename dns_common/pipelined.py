@@ -0,0 +1,166 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: pipelined.py
+# description:
+#   1. PipelinedClient keeps one TCP connection to the local server and lets any number of threads look up names on it
+       at the same time. Every query is tagged with a new request ID (<id, domain, method, request_id>\\n) and a reader
+       thread hands every tagged response to the lookup waiting for its ID, in whatever order the server answers.
+#   2. The local server answers cache hits at once and resolves misses on its worker pool, so a lookup of a cached name
+       is not held up by a miss waiting for a slow upstream server on the same connection.
+#   3. Usage: python pipelined.py {hit domain} {miss domain} [--n 200] [--server 127.0.0.1:5352]
+       sends the miss first and then n lookups of the hit name on the same connection, and prints the latency of the
+       hits while the miss is pending and the latency of the miss. Only 0x00 hits are timed; other answers are
+       counted by code, and the bench fails (exit code 1) when they are the most. Start the local server with --rate 0
+       (no rate limit) for it.
+"""
+
+
+import os
+import sys
+import time
+import socket
+import argparse
+import collections
+import itertools
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common import codec
+from dns_common.querylog import LatencyHistogram
+
+
+LOCAL_SERVER = ('127.0.0.1', 5352)
+
+
+class PipelinedClient:
+
+    def __init__(self, id_='PC_PIPE', server=LOCAL_SERVER, timeout=10.0):
+        self.id = id_
+        self.timeout = timeout
+        self.msg_size = 64 * 1024
+        self.encoder = codec.MessageEncoder(self.id)
+
+        self.connection = socket.create_connection(server, timeout=timeout)
+        self.connection.settimeout(None)
+        self.send_lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+
+        '''pending: formatted as {request_id: {'done': Event, 'response': parsed response}}'''
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.closed = False
+
+        self.reader_thread = threading.Thread(target=self.read_responses)
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+
+    def submit(self, domain, method='I'):
+        """Send a query without waiting. Return the request to wait on (request['done'])."""
+        request_id = str(next(self.request_ids))
+        request = {'done': threading.Event(), 'response': None}
+        with self.pending_lock:
+            self.pending[request_id] = request
+        with self.send_lock:
+            self.connection.sendall(codec.tag(self.encoder.query(domain, method), request_id))
+        return request
+
+    def lookup(self, domain, method='I'):
+        """Return the parsed response (code, id, value[, ttl]), or None if it did not come within timeout."""
+        request = self.submit(domain, method)
+        request['done'].wait(self.timeout)
+        return request['response']
+
+    def read_responses(self):
+        buffer = b''
+        while True:
+            try:
+                data = self.connection.recv(self.msg_size)
+            except OSError:
+                data = b''
+            if data == b'':
+                break
+            lines = (buffer + data).split(b'\n')
+            buffer = lines.pop()
+            for line in lines:
+                untagged = codec.untag(line)
+                if untagged is None:
+                    continue
+                request_id, message = untagged
+                with self.pending_lock:
+                    request = self.pending.pop(request_id, None)
+                if request is not None:
+                    request['response'] = codec.parse_response(message)
+                    request['done'].set()
+
+        '''The connection is closed: wake up every lookup still waiting.'''
+        self.closed = True
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+        for request in pending.values():
+            request['done'].set()
+
+    def close(self):
+        try:
+            with self.send_lock:
+                self.connection.sendall(b'q\n')
+        except OSError:
+            pass
+        self.connection.close()
+
+
+def bench(client, hit_domain, miss_domain, n):
+    """Return (report, failed). Only 0x00 hits are timed; the other answers are counted by code, and the bench failed
+    if they are the most (e.g. 0xFE from the rate limit of the server)."""
+    start = time.perf_counter()
+    miss = client.submit(miss_domain)
+    histogram = LatencyHistogram()
+    codes = collections.Counter()
+    pending_during = 0
+    for _ in range(n):
+        hit_start = time.perf_counter()
+        response = client.lookup(hit_domain)
+        elapsed = (time.perf_counter() - hit_start) * 1000
+        code = response[0] if response is not None else 'none'
+        codes[code] += 1
+        if code == codec.CODE_OK:
+            histogram.add(elapsed)
+            pending_during += not miss['done'].is_set()
+    miss['done'].wait(client.timeout)
+    miss_ms = (time.perf_counter() - start) * 1000
+
+    others = ', '.join('{0}={1}'.format(code, count) for code, count in sorted(codes.items()) if code != codec.CODE_OK)
+    lines = ['hits  ok {0}/{1}  mean {2:.3f}  p50 {3:.3f}  p99 {4:.3f} ms  ({5} while the miss was pending){6}'.format(
+                 codes[codec.CODE_OK], n, histogram.mean(), histogram.percentile(50), histogram.percentile(99),
+                 pending_during, '  not ok: ' + others if others else ''),
+             'miss  {0:.1f} ms  {1}'.format(miss_ms, miss['response'])]
+    failed = codes[codec.CODE_OK] * 2 < n
+    if failed:
+        lines.append('FAIL: most hits were not 0x00, the times above are not lookups. If they are 0xFE, start the '
+                     'local server with --rate 0.')
+    elif miss['response'] is None or miss['response'][0] == codec.CODE_BUSY:
+        lines.append('WARNING: the miss was not resolved: {0}'.format(miss['response']))
+    return '\n'.join(lines), failed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Cache hits and a miss on one pipelined connection.')
+    parser.add_argument('hit_domain')
+    parser.add_argument('miss_domain')
+    parser.add_argument('--n', type=int, default=200)
+    parser.add_argument('--server', default='127.0.0.1:5352')
+    args = parser.parse_args(argv)
+
+    host, port = args.server.rsplit(':', 1)
+    client = PipelinedClient(server=(host, int(port)))
+    try:
+        report, failed = bench(client, args.hit_domain, args.miss_domain, args.n)
+        print(report)
+    finally:
+        client.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
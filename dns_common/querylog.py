@@ -0,0 +1,233 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: querylog.py
+# description:
+#   1. Structured query log. Every server writes one JSON object per answered query to ./log/{id}.qlog:
+       {"ts": unix time, "client": client id, "name": domain, "method": I/R, "code": response code,
+        "hit": answered from cache (true/false, only on the local server), "ms": latency in milliseconds}
+#   2. When the log is bigger than max_bytes, it is renamed to {id}.qlog.{time} and compressed to
+       {id}.qlog.{time}.gz in a background thread. Only the newest backup_count compressed logs are kept.
+#   3. Run this file to analyze query logs (plain or .gz) in one streaming pass with constant memory:
+       python querylog.py ../local_default_server/log/Local_DNS_Server.qlog* [--top {n}]
+       It prints the query count per response code, the cache hit ratio, the cost of a miss, latency percentiles and
+       the most queried names. Top names are counted with the Misra-Gries algorithm (counts are lower bounds) and
+       percentiles come from a log-scale histogram (about 2% error), so memory does not grow with the log size.
+"""
+
+
+import os
+import sys
+import glob
+import gzip
+import json
+import math
+import time
+import shutil
+import argparse
+import threading
+
+
+class QueryLog:
+
+    def __init__(self, file, max_bytes=64 * 1024 * 1024, backup_count=8, flush_interval=1.0):
+        self.file = file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+
+        self.lock = threading.Lock()
+        self.stream = open(file, 'a', encoding='utf-8')
+        self.size = self.stream.tell()
+
+        flush_thread = threading.Thread(target=self.flush_loop)
+        flush_thread.daemon = True
+        flush_thread.start()
+
+    def write(self, client, name, method, code, latency, cache_hit=None, ts=None):
+        """latency in seconds. cache_hit is None on servers without a cache."""
+        now = time.time()
+        record = {'ts': round(ts if ts is not None else now, 6),
+                  'client': client,
+                  'name': name,
+                  'method': method,
+                  'code': code,
+                  }
+        if cache_hit is not None:
+            record['hit'] = cache_hit
+        record['ms'] = round(latency * 1000, 3)
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+
+        with self.lock:
+            if self.stream is None:
+                return
+            self.stream.write(line)
+            self.size += len(line)
+            if self.size >= self.max_bytes:
+                self.rotate()
+
+    def flush_loop(self):
+        '''Records are buffered and written out at least every flush_interval seconds.'''
+        while self.stream is not None:
+            time.sleep(self.flush_interval)
+            with self.lock:
+                if self.stream is not None:
+                    self.stream.flush()
+
+    def rotate(self):
+        '''Called with the lock held.'''
+        self.stream.close()
+        '''The names sort by time, so the oldest logs come first.'''
+        now = time.time()
+        rotated = '{0}.{1}-{2:06d}'.format(self.file, time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+                                          int(now % 1 * 1000000))
+        os.replace(self.file, rotated)
+        self.stream = open(self.file, 'a', encoding='utf-8')
+        self.size = 0
+
+        compress_thread = threading.Thread(target=self.compress, args=(rotated,))
+        compress_thread.daemon = True
+        compress_thread.start()
+
+    def compress(self, rotated):
+        with open(rotated, 'rb') as f_in, gzip.open(rotated + '.gz', 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(rotated)
+
+        backups = sorted(glob.glob(glob.escape(self.file) + '.*.gz'))
+        for old in backups[:-self.backup_count]:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                '''Removed by the compress thread of another rotation.'''
+                pass
+
+    def close(self):
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+
+
+class TopCounter:
+    """Misra-Gries frequent items with at most k counters. Every item more frequent than n / k is kept."""
+
+    def __init__(self, k=1000):
+        self.k = k
+        self.counters = {}
+
+    def add(self, item):
+        counters = self.counters
+        if item in counters:
+            counters[item] += 1
+        elif len(counters) < self.k:
+            counters[item] = 1
+        else:
+            for key in list(counters):
+                counters[key] -= 1
+                if counters[key] == 0:
+                    del counters[key]
+
+    def top(self, n):
+        return sorted(self.counters.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+class LatencyHistogram:
+    """Log-scale histogram from 1 microsecond, every bucket 2% wider than the previous one."""
+
+    def __init__(self, growth=1.02, lowest=0.001):
+        self.log_growth = math.log(growth)
+        self.growth = growth
+        self.lowest = lowest
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, ms):
+        index = 0 if ms <= self.lowest else int(math.log(ms / self.lowest) / self.log_growth) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += ms
+
+    def value(self, index):
+        return 0.0 if index == 0 else self.lowest * self.growth ** index
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * p / 100.0)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return self.value(index)
+        return self.value(max(self.buckets))
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+def open_log(file):
+    if file.endswith('.gz'):
+        return gzip.open(file, 'rt', encoding='utf-8')
+    return open(file, encoding='utf-8')
+
+
+def analyze(files, k=1000):
+    codes = {}
+    names = TopCounter(k)
+    latency = LatencyHistogram()
+    hit_latency = LatencyHistogram()
+    miss_latency = LatencyHistogram()
+
+    for file in files:
+        with open_log(file) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                codes[record['code']] = codes.get(record['code'], 0) + 1
+                names.add(record['name'])
+                latency.add(record['ms'])
+                if record.get('hit') is True:
+                    hit_latency.add(record['ms'])
+                elif record.get('hit') is False:
+                    miss_latency.add(record['ms'])
+
+    return {'codes': codes, 'names': names, 'latency': latency, 'hit': hit_latency, 'miss': miss_latency}
+
+
+def report(result, n_top=10):
+    latency = result['latency']
+    hits = result['hit'].count
+    misses = result['miss'].count
+    lines = ['queries: {0}'.format(latency.count)]
+    lines.append('codes: ' + ', '.join('{0}={1}'.format(code, n) for code, n in sorted(result['codes'].items())))
+    if hits + misses:
+        lines.append('cache hit ratio: {0:.2%} ({1} hits, {2} misses)'.format(hits / (hits + misses), hits, misses))
+        lines.append('miss cost: mean {0:.3f} ms per miss vs {1:.3f} ms per hit, {2:.1f} ms in total'.format(
+            result['miss'].mean(), result['hit'].mean(), result['miss'].total))
+    lines.append('latency ms: mean {0:.3f}, p50 {1:.3f}, p90 {2:.3f}, p99 {3:.3f}, p99.9 {4:.3f}'.format(
+        latency.mean(), latency.percentile(50), latency.percentile(90), latency.percentile(99),
+        latency.percentile(99.9)))
+    lines.append('top names:')
+    for name, count in result['names'].top(n_top):
+        lines.append('  {0:>10}  {1}'.format(count, name))
+    return '\n'.join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Analyze structured query logs (plain or .gz).')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--top', type=int, default=10, help='number of top names to print')
+    parser.add_argument('--counters', type=int, default=1000, help='memory bound of the top names counter')
+    args = parser.parse_args(argv)
+
+    print(report(analyze(args.files, args.counters), args.top))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
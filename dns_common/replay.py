@@ -0,0 +1,228 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: replay.py
+# description:
+#   1. Traffic capture and replay for performance regression tests.
+#   2. Capture: python local_server.py --capture {file} (DNSDefaultServer(capture_file=...)) writes every incoming
+       client query to the capture file, one JSON object per line: {"ts": arrival time (unix seconds), "session":
+       "ip:port" of the client, "query": raw message, "transport": "tcp" or "udp"}. Queries are recorded before the
+       rate limit, so the replay also sends the queries which were refused.
+#   3. Replay a capture, or the old message log format of Local_DNS_Server.log, against a running local server:
+       python replay.py run {capture or log file} [--target 127.0.0.1:5352] [--speed 1.0 | --asap] [--connections 4]
+                        [--output result.jsonl]
+       - --speed 1.0 keeps the original timing, --speed 10 plays 10 times faster, --asap sends without waiting.
+       - The old log format has no timestamps, so its queries are spaced by --interval seconds.
+       - Queries of one session always go over the same connection, in order. Queries captured over UDP are replayed
+         as datagrams, the others (and those of the old log format) over TCP.
+       - Latency is measured from the time a query was due, so a slow server cannot hide its own queueing.
+       Remember that the local server rate limits each client address: start it with --rate 0 for fast replays.
+#   4. Compare two replays, e.g. of the same capture against two builds:
+       python replay.py compare {base result} {new result}
+       It prints the latency percentiles and response codes side by side and counts the answers which changed.
+"""
+
+
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common import codec
+from dns_common.querylog import LatencyHistogram
+
+
+class CaptureWriter:
+
+    def __init__(self, file):
+        self.lock = threading.Lock()
+        self.stream = open(file, 'a', encoding='utf-8', buffering=1)
+
+    def write(self, address, query, ts, transport='tcp'):
+        line = json.dumps({'ts': round(ts, 6), 'session': '{0}:{1}'.format(address[0], address[1]), 'query': query,
+                           'transport': transport}, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.stream is not None:
+                self.stream.write(line)
+
+    def close(self):
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+
+
+def read_capture(file, interval=0.01):
+    """Return [(ts, session, query, transport), ] from a capture file or from the old message log format."""
+    with open(file, encoding='utf-8') as f:
+        lines = f.read().split('\n')
+
+    if lines and lines[0].startswith('{'):
+        records = []
+        for line in lines:
+            if line.strip():
+                record = json.loads(line)
+                records.append((record['ts'], record['session'], record['query'], record.get('transport', 'tcp')))
+        return records
+
+    '''Old log format: blocks separated by a blank line. The first line of a block is the client query.'''
+    records = []
+    block_start = True
+    for line in lines:
+        if line.strip() == '':
+            block_start = True
+            continue
+        if block_start:
+            block_start = False
+            fields = [field.strip() for field in line.split(',')]
+            if len(fields) == 3 and not fields[0].startswith('0x') and fields[2] in ('I', 'R'):
+                records.append((len(records) * interval, fields[0], '<{0}>'.format(line.strip()), 'tcp'))
+    return records
+
+
+def replay_worker(target, transport, jobs, results):
+    if transport == 'udp':
+        connection = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    else:
+        connection = socket.create_connection(target)
+    connection.settimeout(10)
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            index, due, query = job
+            try:
+                if transport == 'udp':
+                    connection.sendto(bytes(query, encoding='utf-8'), target)
+                    data = connection.recvfrom(64 * 1024)[0]
+                else:
+                    connection.sendall(bytes(query, encoding='utf-8'))
+                    data = connection.recv(64 * 1024)
+            except OSError:
+                data = b''
+            response = codec.parse_response(data)
+            code = response[0] if response is not None else 'ERROR'
+            answer = response[2] if response is not None else ''
+            results[index] = {'i': index, 'query': query, 'code': code, 'answer': answer,
+                              'ms': round((time.time() - due) * 1000, 3)}
+    finally:
+        if transport == 'tcp':
+            try:
+                connection.sendall(b'q')
+            except OSError:
+                pass
+        connection.close()
+
+
+def replay(records, target, speed=1.0, connections=4):
+    """Play records against target. speed None means as fast as possible. Return the result of every query.
+    Every transport in the records gets its own connections (UDP sockets for udp)."""
+    results = [None] * len(records)
+    workers = []
+    jobs = {}
+    for transport in sorted(set(record[3] for record in records)):
+        jobs[transport] = []
+        for _ in range(connections):
+            worker_jobs = queue.Queue()
+            worker = threading.Thread(target=replay_worker, args=(target, transport, worker_jobs, results))
+            worker.start()
+            workers.append(worker)
+            jobs[transport].append(worker_jobs)
+
+    sessions = {transport: {} for transport in jobs}
+    start = time.time()
+    origin = records[0][0] if records else 0
+    for index, (ts, session, query, transport) in enumerate(records):
+        due = start if speed is None else start + (ts - origin) / speed
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        worker_index = sessions[transport].setdefault(session, len(sessions[transport]) % connections)
+        jobs[transport][worker_index].put((index, due, query))
+
+    for transport_jobs in jobs.values():
+        for worker_jobs in transport_jobs:
+            worker_jobs.put(None)
+    for worker in workers:
+        worker.join()
+    return [result for result in results if result is not None]
+
+
+def summary(results):
+    histogram = LatencyHistogram()
+    codes = {}
+    for result in results:
+        histogram.add(result['ms'])
+        codes[result['code']] = codes.get(result['code'], 0) + 1
+    return histogram, codes
+
+
+def read_results(file):
+    with open(file, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def format_summary(name, results):
+    histogram, codes = summary(results)
+    return '{0:<10} n {1:>7}  p50 {2:9.3f}  p90 {3:9.3f}  p99 {4:9.3f}  max {5:9.3f} ms  {6}'.format(
+        name, histogram.count, histogram.percentile(50), histogram.percentile(90), histogram.percentile(99),
+        histogram.percentile(100), ', '.join('{0}={1}'.format(code, n) for code, n in sorted(codes.items())))
+
+
+def compare(base, new):
+    lines = [format_summary('base', base), format_summary('new', new)]
+    new_by_index = {result['i']: result for result in new}
+    changed = 0
+    for result in base:
+        other = new_by_index.get(result['i'])
+        if other is not None and (other['code'], other['answer']) != (result['code'], result['answer']):
+            changed += 1
+            if changed <= 10:
+                lines.append('  changed: {0}  {1} {2} -> {3} {4}'.format(
+                    result['query'], result['code'], result['answer'], other['code'], other['answer']))
+    lines.append('{0} of {1} answers changed'.format(changed, len(base)))
+    return '\n'.join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Replay captured DNS traffic and compare builds.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='replay a capture or an old Local_DNS_Server.log')
+    run.add_argument('capture')
+    run.add_argument('--target', default='127.0.0.1:5352')
+    run.add_argument('--speed', type=float, default=1.0, help='1.0 keeps the original timing')
+    run.add_argument('--asap', action='store_true', help='send as fast as possible')
+    run.add_argument('--interval', type=float, default=0.01, help='spacing of queries from the old log format')
+    run.add_argument('--connections', type=int, default=4)
+    run.add_argument('--output', help='write the result of every query to this file')
+
+    diff = commands.add_parser('compare', help='compare the results of two replays')
+    diff.add_argument('base')
+    diff.add_argument('new')
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        print(compare(read_results(args.base), read_results(args.new)))
+        return 0
+
+    host, port = args.target.rsplit(':', 1)
+    records = read_capture(args.capture, args.interval)
+    results = replay(records, (host, int(port)), None if args.asap else args.speed, args.connections)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, separators=(',', ':')) + '\n')
+    print(format_summary('replay', results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,98 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: stress_records.py
+# description:
+#   1. Check of RecordTable (records.py). Random sets, replaces and deletes of IPv4 and IPv6 records are done on a
+       RecordTable and on a dict at the same time; any difference in the answers, the length or the items is a failure.
+#   2. Then every name is replaced again and again (pop and set, as a zone update does) with IPv4 and IPv6 addresses.
+       The rows, the IPv6 items and the arena must stay within a bound of the live records, otherwise it is a failure.
+#   3. The script exits with code 1 on failure.
+#   4. Usage: python stress_records.py [n_operations] [n_replaces]
+"""
+
+
+import os
+import sys
+import random
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common.records import RecordTable
+
+
+N_KEYS = 1000
+
+
+def domain_of(key):
+    return 'host{0}.stress.com'.format(key)
+
+
+def ip_of(key, version):
+    if version % 3 == 0:
+        return '2001:db8::{0:x}:{1:x}'.format(key + 1, version & 0xFFFF)
+    return '10.{0}.{1}.{2}'.format(key >> 8 & 255, key & 255, version & 255)
+
+
+def check_random(n_operations, seed=1):
+    """Return the description of the first difference from a dict, or None."""
+    rand = random.Random(seed)
+    table = RecordTable()
+    expected = {}
+    for step in range(n_operations):
+        key = rand.randrange(N_KEYS)
+        name = domain_of(key)
+        action = rand.random()
+        if action < 0.6:
+            ip = ip_of(key, rand.randrange(1000))
+            table[name] = ip
+            expected[name] = ip
+        elif action < 0.8:
+            if table.pop(name, None) != expected.pop(name, None):
+                return 'step {0}: pop {1} differs'.format(step, name)
+        elif table.get(name) != expected.get(name):
+            return 'step {0}: get {1} differs'.format(step, name)
+        if len(table) != len(expected):
+            return 'step {0}: length {1} != {2}'.format(step, len(table), len(expected))
+    if dict(table.items()) != expected:
+        return 'items differ'
+    return None
+
+
+def check_replaces(n_replaces):
+    """Return the description of the first unbounded growth, or None."""
+    table = RecordTable()
+    for key in range(N_KEYS):
+        table[domain_of(key)] = ip_of(key, 1)
+    name_bytes = len(table.arena)
+
+    for version in range(n_replaces):
+        key = version % 10
+        table.pop(domain_of(key))
+        table[domain_of(key)] = ip_of(key, version)
+        '''Address changes in place too: IPv6 to IPv6 and IPv4 to IPv6 and back.'''
+        table[domain_of(N_KEYS - 1 - key)] = ip_of(key, version)
+
+    rows, v6_items = len(table.family), len(table.v6_high)
+    print('{0} replaces: {1} rows, {2} IPv6 items, arena {3} bytes for {4} records ({5} bytes of names)'.format(
+        n_replaces, rows, v6_items, len(table.arena), len(table), name_bytes))
+    if rows > 2 * len(table) + 64 or v6_items > 2 * len(table) + 64 or len(table.arena) > 2 * name_bytes + 64 * 32:
+        return 'the table grows with the replaces'
+    for key in range(10, N_KEYS - 10):
+        if table.get(domain_of(key)) != ip_of(key, 1):
+            return 'record {0} lost'.format(domain_of(key))
+    return None
+
+
+def main(n_operations=200000, n_replaces=20000):
+    failures = [failure for failure in (check_random(n_operations), check_replaces(n_replaces)) if failure]
+    for failure in failures:
+        print('FAIL: {0}'.format(failure))
+    if failures:
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -0,0 +1,170 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: trace.py
+# description:
+#   1. Cross-hop query tracing. The local default server samples a part of the client queries (trace_sample) and gives
+       each sampled query a trace ID. The trace ID is sent to the root and TLS servers as a 4th field of the query:
+       <id, domain, method, trace_id>. Queries without the 4th field are not traced.
+#   2. Every hop records one span per traced query to ./log/{id}.trace, one JSON object per line:
+       {"trace": trace_id, "hop": server id, "name": domain, "start": arrival time (unix seconds),
+        "queue": ms from arrival to start of processing, "process": ms of own work, "upstream": ms waiting on upstream
+        servers, "code": response code}
+#   3. Run this file to reassemble the timelines of full queries from the trace files of all hops:
+       python trace.py ../local_default_server/log/*.trace ../root_dns_server/log/*.trace ../tls_dns_server/log/*.trace
+       Options: --trace {trace_id} shows one query, --top {n} shows the n slowest queries.
+"""
+
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+
+
+class Span:
+
+    def __init__(self, tracer, trace_id, name, arrived=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.name = name
+        self.arrived = arrived if arrived is not None else time.time()
+        self.started = None
+        self.upstream = 0.0
+        self.upstream_start = None
+
+    def start(self):
+        self.started = time.time()
+
+    def upstream_begin(self):
+        self.upstream_start = time.time()
+
+    def upstream_end(self):
+        if self.upstream_start is not None:
+            self.upstream += time.time() - self.upstream_start
+            self.upstream_start = None
+
+    def finish(self, code):
+        now = time.time()
+        self.upstream_end()
+        started = self.started if self.started is not None else self.arrived
+        self.tracer.record({'trace': self.trace_id,
+                            'hop': self.tracer.hop,
+                            'name': self.name,
+                            'start': round(self.arrived, 6),
+                            'queue': round((started - self.arrived) * 1000, 3),
+                            'process': round((now - started - self.upstream) * 1000, 3),
+                            'upstream': round(self.upstream * 1000, 3),
+                            'code': code,
+                            })
+
+
+class NullSpan:
+    """Span of a query which is not sampled. It records nothing."""
+
+    trace_id = None
+
+    def start(self):
+        pass
+
+    def upstream_begin(self):
+        pass
+
+    def upstream_end(self):
+        pass
+
+    def finish(self, code):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+
+    def __init__(self, hop, file, sample_rate=0.0):
+        self.hop = hop
+        self.file = file
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+
+    def new_trace_id(self):
+        """Return a new trace ID if this query is sampled, otherwise None."""
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return '{0:016x}'.format(random.getrandbits(64))
+        return None
+
+    def span(self, trace_id, name, arrived=None):
+        if trace_id is None or trace_id == '':
+            return NULL_SPAN
+        return Span(self, trace_id, name, arrived)
+
+    def record(self, span):
+        line = json.dumps(span, separators=(',', ':')) + '\n'
+        with self.lock:
+            with open(self.file, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+def read_spans(files):
+    for file in files:
+        with open(file, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+
+def build_timelines(files):
+    """Return {trace_id: [span, ]} with the spans of every trace sorted by arrival time."""
+    timelines = {}
+    for span in read_spans(files):
+        timelines.setdefault(span['trace'], []).append(span)
+    for spans in timelines.values():
+        spans.sort(key=lambda span: span['start'])
+    return timelines
+
+
+def total_ms(spans):
+    first = spans[0]
+    return first['queue'] + first['process'] + first['upstream']
+
+
+def format_timeline(trace_id, spans):
+    origin = spans[0]['start']
+    lines = ['trace {0}  {1}  total {2:.3f} ms'.format(trace_id, spans[0]['name'], total_ms(spans))]
+    for span in spans:
+        lines.append('  +{0:9.3f} ms  {1:<20} queue {2:8.3f}  process {3:8.3f}  upstream {4:8.3f}  {5}'.format(
+            (span['start'] - origin) * 1000, span['hop'], span['queue'], span['process'], span['upstream'],
+            span['code']))
+    return '\n'.join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Reassemble query timelines from the trace files of all hops.')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--trace', help='show only this trace ID')
+    parser.add_argument('--top', type=int, default=0, help='show only the n slowest queries')
+    args = parser.parse_args(argv)
+
+    timelines = build_timelines([file for file in args.files if os.path.exists(file)])
+    if args.trace:
+        timelines = {args.trace: timelines[args.trace]} if args.trace in timelines else {}
+
+    items = sorted(timelines.items(), key=lambda item: item[1][0]['start'])
+    if args.top:
+        items = sorted(items, key=lambda item: total_ms(item[1]), reverse=True)[:args.top]
+    for trace_id, spans in items:
+        print(format_timeline(trace_id, spans))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,123 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: admission.py
+# description:
+#   1. Admission control for DNSDefaultServer. It bounds the number of concurrent client sessions, the number of
+       in-flight upstream resolutions and the query rate of every client address (token bucket).
+#   2. Every rejected session or query is counted, so the manager can see how much load was shed. The counters are
+       exported by stats() and answered to the control message SERVER_STATS_ASK.
+#   3. A limit of None means unlimited.
+#   4. wait_idle() blocks until every in-flight resolution has finished, which is used to drain the server on shutdown.
+"""
+
+
+import time
+import threading
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def consume(self, now, n=1):
+        self.refill(now)
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+
+class AdmissionController:
+
+    def __init__(self, max_sessions=64, max_inflight=32, rate=20.0, burst=40, max_buckets=4096):
+        self.max_sessions = max_sessions
+        self.max_inflight = max_inflight
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.sessions = 0
+        self.inflight = 0
+
+        '''buckets: formatted as {client_ip: TokenBucket}'''
+        self.buckets = {}
+
+        self.shed_session = 0
+        self.shed_inflight = 0
+        self.shed_rate = 0
+
+    def acquire_session(self):
+        with self.lock:
+            if self.max_sessions is not None and self.sessions >= self.max_sessions:
+                self.shed_session += 1
+                return False
+            self.sessions += 1
+            return True
+
+    def release_session(self):
+        with self.lock:
+            self.sessions -= 1
+
+    def acquire_inflight(self):
+        with self.lock:
+            if self.max_inflight is not None and self.inflight >= self.max_inflight:
+                self.shed_inflight += 1
+                return False
+            self.inflight += 1
+            return True
+
+    def release_inflight(self):
+        with self.lock:
+            self.inflight -= 1
+            if self.inflight == 0:
+                self.idle.notify_all()
+
+    def wait_idle(self, timeout):
+        with self.lock:
+            return self.idle.wait_for(lambda: self.inflight == 0, timeout)
+
+    def allow_query(self, client_ip):
+        if self.rate is None:
+            return True
+
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(client_ip)
+            if bucket is None:
+                if len(self.buckets) >= self.max_buckets:
+                    self.prune_buckets(now)
+                bucket = TokenBucket(self.rate, self.burst)
+                self.buckets[client_ip] = bucket
+
+            if bucket.consume(now):
+                return True
+            self.shed_rate += 1
+            return False
+
+    def prune_buckets(self, now):
+        '''A bucket which has refilled completely carries no state, so it is safe to forget it.'''
+        for client_ip, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[client_ip]
+
+    def stats(self):
+        with self.lock:
+            return {'sessions': self.sessions,
+                    'inflight': self.inflight,
+                    'shed_session': self.shed_session,
+                    'shed_inflight': self.shed_inflight,
+                    'shed_rate': self.shed_rate,
+                    }
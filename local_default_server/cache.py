@@ -0,0 +1,189 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: cache.py
+# description:
+#   1. The cache of DNSDefaultServer. It is used like the dict it replaces (get, [], in, len) but every entry carries
+       an expire time and a hit counter.
+#   2. An entry whose TTL has run out is a miss. It is kept for stale_grace more seconds, so get_stale() can still
+       return it when the upstream servers fail (serve-stale), and dropped when it is read after that. Snapshots only
+       keep live entries.
+#   3. When the server starts from a snapshot (snapshot.py), a domain which is not in memory is looked up in the mapped
+       snapshot and moved into memory on its first hit, so the old hit rate comes back at once.
+#   4. save() merges the in-memory entries with the snapshot entries which were never read and writes a new snapshot.
+#   5. The cache is shared by all the connection threads. Entries are split into shards by the hash of the domain and
+       every shard has its own lock, so writers only block writers of the same shard. Reads do not lock: a single
+       dict.get is atomic in CPython. Iteration (entries, save) copies one shard at a time under its lock, so it never
+       sees a dict changing size. Hit counters are not locked and are approximate.
+#   6. invalidate() drops a name which changed upstream. A name which is still in the mapped snapshot gets an empty
+       entry (a tombstone) in memory, so the snapshot cannot bring the old address back; tombstones are misses and are
+       not written to the next snapshot.
+#   7. Entries are __slots__ objects (snapshot.CacheEntry) and names which are only in the snapshot stay in the mapped
+       file, packed, until they are read. Addresses of the default file are validated (dns_common/records.py): a line
+       with a malformed address such as 78.46.893.288 is skipped with a warning.
+"""
+
+
+import os
+import sys
+import time
+import threading
+
+from snapshot import CacheEntry, Snapshot, write_snapshot
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common.records import valid_address
+
+
+class DNSCache:
+
+    def __init__(self, ttl=3600, snapshot=None, n_shards=16, stale_grace=0):
+        self.ttl = ttl
+        self.snapshot = snapshot
+        self.stale_grace = stale_grace
+
+        '''shards: formatted as [{domain: CacheEntry}, ], locks[i] guards the writes of shards[i]'''
+        self.shards = [{} for _ in range(n_shards)]
+        self.locks = [threading.Lock() for _ in range(n_shards)]
+        self.dirty = False
+        self.save_lock = threading.Lock()
+
+    def shard_index(self, domain):
+        return hash(domain) % len(self.shards)
+
+    def get(self, domain, default=''):
+        now = time.time()
+        index = self.shard_index(domain)
+        shard = self.shards[index]
+        entry = shard.get(domain)
+        if entry is None:
+            snapshot = self.snapshot
+            if snapshot is not None:
+                entry = snapshot.lookup(domain, now)
+                if entry is not None:
+                    with self.locks[index]:
+                        entry = shard.setdefault(domain, entry)
+
+        if entry is None:
+            return default
+        if entry.expire <= now:
+            if entry.expire + self.stale_grace <= now:
+                with self.locks[index]:
+                    if shard.get(domain) is entry:
+                        del shard[domain]
+            return default
+        if entry.ip == '':
+            return default
+
+        entry.hits += 1
+        return entry.ip
+
+    def get_stale(self, domain, default=''):
+        """Return the IP of domain even if its TTL has run out less than stale_grace seconds ago."""
+        entry = self.shards[self.shard_index(domain)].get(domain)
+        if entry is None or entry.ip == '' or entry.expire + self.stale_grace <= time.time():
+            return default
+        entry.hits += 1
+        return entry.ip
+
+    def remaining(self, domain):
+        """Return the whole seconds until the in-memory entry of domain expires, 0 if it has none or it expired."""
+        entry = self.shards[self.shard_index(domain)].get(domain)
+        if entry is None or entry.ip == '':
+            return 0
+        return max(int(entry.expire - time.time()), 0)
+
+    def __getitem__(self, domain):
+        ip = self.get(domain, None)
+        if ip is None:
+            raise KeyError(domain)
+        return ip
+
+    def __setitem__(self, domain, ip):
+        self.set(domain, ip)
+
+    def __contains__(self, domain):
+        return self.get(domain, None) is not None
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def set(self, domain, ip, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        index = self.shard_index(domain)
+        shard = self.shards[index]
+        with self.locks[index]:
+            old = shard.get(domain)
+            hits = old.hits if old is not None else 0
+            shard[domain] = CacheEntry(ip, time.time() + ttl, hits)
+        self.dirty = True
+
+    def invalidate(self, domain):
+        """Drop domain. Return True if it was cached."""
+        now = time.time()
+        index = self.shard_index(domain)
+        shard = self.shards[index]
+        snapshot = self.snapshot
+        in_snapshot = snapshot is not None and snapshot.lookup(domain, now) is not None
+        with self.locks[index]:
+            entry = shard.pop(domain, None)
+            if in_snapshot:
+                shard[domain] = CacheEntry('', now + self.ttl, 0)
+        self.dirty = True
+        return in_snapshot or (entry is not None and entry.ip != '')
+
+    def invalidate_zone(self, tld):
+        """Drop every name of the zone tld, e.g. 'com'. Return the number of names dropped."""
+        suffix = '.' + tld
+        return sum(1 for domain in self.entries() if domain.endswith(suffix) and self.invalidate(domain))
+
+    def entries(self, now=None):
+        """Return {domain: CacheEntry} of all live entries, including the ones still only in the snapshot."""
+        if now is None:
+            now = time.time()
+
+        result = {}
+        snapshot = self.snapshot
+        if snapshot is not None:
+            for domain, entry in snapshot.entries(now):
+                result[domain] = entry
+        for index, shard in enumerate(self.shards):
+            with self.locks[index]:
+                items = list(shard.items())
+            for domain, entry in items:
+                if entry.ip == '':
+                    result.pop(domain, None)
+                elif entry.expire > now:
+                    result[domain] = entry
+        return result
+
+    def items(self):
+        return [(domain, entry.ip) for domain, entry in self.entries().items()]
+
+    def save(self, file):
+        with self.save_lock:
+            self.dirty = False
+            write_snapshot(file, self.entries())
+            '''Map the new file. Entries moved into memory are copies, so the old mapping is released by itself.'''
+            self.snapshot = Snapshot.open(file)
+
+    @classmethod
+    def load(cls, snapshot_file, default_file, ttl=3600, stale_grace=0):
+        """Start from the snapshot if there is one, otherwise from the plain text default file (domain ip per line)."""
+        snapshot = Snapshot.open(snapshot_file)
+        if snapshot is not None:
+            return cls(ttl, snapshot, stale_grace=stale_grace)
+
+        cache = cls(ttl, stale_grace=stale_grace)
+        with open(default_file) as f:
+            for line_number, line in enumerate(f, 1):
+                line_list = line.strip().split()
+                if len(line_list) != 2:
+                    continue
+                if valid_address(line_list[1]):
+                    cache.set(line_list[0].lower(), line_list[1])
+                else:
+                    print('{0} line {1} skipped: Bad address: {2}'.format(default_file, line_number, line_list[1]))
+        return cache
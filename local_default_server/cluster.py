@@ -0,0 +1,148 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: cluster.py
+# description:
+#   1. Cluster mode of DNSDefaultServer. Local servers listed in a static peer file (peers.dat, one "node_id ip port"
+       per line, port is the peer port of the node) form a peer group and split the name space by consistent hashing.
+#   2. HashRing puts vnodes points per node on a ring of 64 bit md5 hashes. A name belongs to the first node point after
+       the hash of the name. A node joining or leaving only moves the names between its points and the points before
+       them, about 1/N of all names. "www." is cut from a name before hashing, because the server treats www.x and x
+       as the same name.
+#   3. A miss on a node which does not own the name is sent to the owner over the peer protocol: the usual query
+       <node_id, domain, method[, trace_id]> to the peer port of the owner, which answers from its cache or asks the
+       root server itself and never forwards it again. Only the owner goes upstream and caches the answer.
+#   4. A peer which cannot be reached is taken out of the ring for retry_interval seconds, so its names move to the
+       other nodes and are resolved there until it is back.
+#   5. Run this file to see how a peer list splits the names and how many move when a node leaves or joins:
+       python cluster.py ./data/peers.dat [n_names]
+"""
+
+
+import sys
+import time
+import bisect
+import struct
+import hashlib
+import threading
+
+
+def ring_hash(key):
+    return struct.unpack('>Q', hashlib.md5(bytes(key, encoding='utf-8')).digest()[:8])[0]
+
+
+def ring_key(domain):
+    return domain[4:] if domain.startswith('www.') else domain
+
+
+def read_peer_file(file):
+    """Return {node_id: (ip, port)} from lines of "node_id ip port"."""
+    peers = {}
+    with open(file) as f:
+        data = f.readlines()
+    for line in data:
+        line_list = line.strip().split()
+        if len(line_list) == 3:
+            peers[line_list[0]] = (line_list[1], int(line_list[2]))
+    return peers
+
+
+class HashRing:
+
+    def __init__(self, nodes, vnodes=160):
+        self.nodes = sorted(nodes)
+        self.vnodes = vnodes
+
+        '''points: sorted hashes of all virtual nodes, owners[i] is the node of points[i]'''
+        points = sorted((ring_hash('{0}#{1}'.format(node, i)), node) for node in self.nodes for i in range(vnodes))
+        self.points = [point for point, node in points]
+        self.owners = [node for point, node in points]
+
+    def owner(self, domain):
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, ring_hash(ring_key(domain)))
+        if index == len(self.points):
+            index = 0
+        return self.owners[index]
+
+
+class Cluster:
+
+    def __init__(self, node_id, peers, vnodes=160, retry_interval=10.0):
+        if node_id not in peers:
+            raise ValueError('{0} is not in the peer list'.format(node_id))
+        self.node_id = node_id
+        self.peers = peers
+        self.address = peers[node_id]
+        self.vnodes = vnodes
+        self.retry_interval = retry_interval
+
+        self.lock = threading.Lock()
+        '''down: formatted as {node_id: time to try again}'''
+        self.down = {}
+        self.ring = HashRing(peers, vnodes)
+
+        self.forwarded = 0
+        self.peer_failed = 0
+        self.served = 0
+
+    def owner(self, domain):
+        """Return the node which owns domain among the nodes which are up."""
+        if self.down:
+            self.revive(time.time())
+        return self.ring.owner(domain)
+
+    def is_owner(self, domain):
+        return self.owner(domain) == self.node_id
+
+    def mark_down(self, node_id):
+        with self.lock:
+            self.peer_failed += 1
+            if node_id == self.node_id or node_id in self.down:
+                return
+            self.down[node_id] = time.time() + self.retry_interval
+            self.ring = HashRing([node for node in self.peers if node not in self.down], self.vnodes)
+
+    def revive(self, now):
+        with self.lock:
+            back = [node for node, retry_at in self.down.items() if retry_at <= now]
+            if not back:
+                return
+            for node in back:
+                del self.down[node]
+            self.ring = HashRing([node for node in self.peers if node not in self.down], self.vnodes)
+
+    def stats(self):
+        return {'peers_up': len(self.peers) - len(self.down),
+                'forwarded': self.forwarded,
+                'peer_failed': self.peer_failed,
+                'served_for_peers': self.served,
+                }
+
+
+def main(argv):
+    peers = read_peer_file(argv[0])
+    n = int(argv[1]) if len(argv) > 1 else 100000
+    names = ['host{0}.com'.format(i) for i in range(n)]
+
+    ring = HashRing(peers)
+    owners = {name: ring.owner(name) for name in names}
+    for node in ring.nodes:
+        share = sum(1 for owner in owners.values() if owner == node) / n
+        print('{0:<24} owns {1:6.2%}'.format(node, share))
+
+    for node in ring.nodes:
+        smaller = HashRing([other for other in ring.nodes if other != node])
+        moved = sum(1 for name in names if smaller.owner(name) != owners[name]) / n
+        print('{0:<24} leaves: {1:6.2%} of the names move'.format(node, moved))
+
+    bigger = HashRing(ring.nodes + ['new_node'])
+    moved = sum(1 for name in names if bigger.owner(name) != owners[name]) / n
+    print('{0:<24} joins:  {1:6.2%} of the names move'.format('new_node', moved))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
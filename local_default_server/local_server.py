@@ -19,75 +19,220 @@
       5.2. If the method is iterative (I), root DNS server will send next query address. Then, establish a connection
            and make a query.
 #   6. If any of the server that DNS local default server requests break down or loss connection, the local server will
-       send <0xFF, {id}, "Host not found"> back to client.
+       send <0xFF, {id}, "Host not found"> back to client, unless it can serve a stale answer (see 17).
 #   7. When receive heartbeat packet from client, the server will give a acknowledgement.
-#   8. When manager press ctrl + C (KeyboardInterrupt) or system exit, the server will start to shutdown. It will close
-       all the connections and send a broadcast: SERVER_SHUTDOWN: CONNECTION CLOSE to all online users.
+#   8. When manager press ctrl + C (KeyboardInterrupt) or system exit, the server will start to shutdown. It stops
+       accepting, waits (at most drain_timeout seconds) for the in-flight resolutions to finish, sends a broadcast:
+       SERVER_SHUTDOWN: CONNECTION CLOSE to all online users at once, closes all the connections and writes the cache.
 #   9. The server will output a log file ({id}.log) whenever it receive or send message to server/client except the
     heartbeat message because heartbeat message is meaningless.
-#   10. Every time when the cache update, server will write the cache to default.dat file to ensure next time the server
-    can 'remember' history log.
+#   10. Every cache entry has a TTL (cache_ttl) and a hit counter. Every snapshot_interval seconds (if the cache changed)
+    and on shutdown, the server writes the cache to a binary snapshot (default.snap, see snapshot.py) to ensure next
+    time the server can 'remember' history log. On start, the snapshot is mapped and read lazily; default.dat is only
+    read when there is no snapshot.
+#   11. Admission control (admission.py): the accept backlog, the number of concurrent sessions, the number of in-flight
+    upstream resolutions and the query rate of each client address are all bounded. Overload is rejected with
+    <0xFE, {id}, "Server busy"> or <0xFE, {id}, "Rate limit exceeded">. The shed-load counters are answered to the
+    control message SERVER_STATS_ASK. The limits are set on the command line (--backlog 128 --max-sessions 64
+    --max-inflight 32), e.g. as options of the local tier in the supervisor topology. The query rate of a client
+    address is rate per second with bursts of burst queries (--rate 20 --burst 40); every client of this project runs
+    on 127.0.0.1, so the benchmark and replay tools need a raised limit, or none: --rate 0.
+#   12. A part (trace_sample) of the client queries is traced across hops (dns_common/trace.py): the trace ID is sent to
+    the root and TLS servers with the query and every hop writes its span timings to ./log/{id}.trace.
+#   13. Every answered query is also written to the structured query log ./log/{id}.qlog (dns_common/querylog.py) with
+    timestamp, client, name, method, response code, cache hit flag and latency. The query log rotates and compresses
+    itself.
+#   14. Capture mode: with capture_file set (--capture ./log/capture.jsonl), every incoming client query is recorded
+    with its arrival time and transport (also those refused by the rate limit), so the traffic can be replayed against
+    another build with dns_common/replay.py.
+#   15. The server also listens for single-datagram queries on UDP (127.0.0.1, 5352), served by udp_workers threads from
+    the same cache and resolver, without a handshake or a session thread per client. A response which does not fit in
+    udp_payload_size bytes is replaced by <0xFC, {id}, "Truncated: retry over TCP">, and the client asks again over TCP
+    (see dns_common/lookup.py). UDP queries are rate limited per address like TCP queries.
+#   16. Cluster mode (cluster.py): with a peer list, several local servers split the names by consistent hashing. A
+    miss on a node which does not own the name is asked from the owner on its peer port before going upstream, so
+    every name is resolved and cached by one node. Run several nodes on one machine with
+    python local_server.py --id Local_DNS_Server_1 --port 5352 --peers ./data/peers.dat
+    python local_server.py --id Local_DNS_Server_2 --port 5362 --peers ./data/peers.dat
+    python local_server.py --id Local_DNS_Server_3 --port 5372 --peers ./data/peers.dat
+#   17. Serve-stale: an expired cache entry is kept stale_grace more seconds. A query for it starts a background refresh
+    (one per name at a time) and waits at most stale_budget seconds. If the refresh has not answered by then, or the
+    upstream servers fail or are busy, the stale answer is sent at once and the refresh goes on to update the cache.
+    A "Host not found" from the TLS server is a real answer and is sent as it is. Set stale_grace=0 to disable.
+#   18. Aliases (CNAME) are followed by the TLS servers, which send the address with the whole alias chain. When a chain
+    goes on in another zone (<0x02, ...>), the local server asks for the next name itself, at most max_alias_depth
+    names deep and never twice. Every name of the chain is cached with the final address, so the next query for any
+    alias is a cache hit. The client gets <0x00, {id}, ip, ttl> as for any answer. The server remembers which aliases
+    were cached with the address of each name, so when a zone change drops the name, the aliases leading to it (in any
+    zone) go too.
+#   19. Zone changes: the TLS servers take signed update batches (tls_dns_server/zone_update.py) and count them with a
+    serial. Every zone_poll_interval seconds the local server asks each TLS server it knows (learned from the
+    referrals of iterative queries, or given as zone_servers) for the names changed since the serial it saw last, and
+    drops them from the cache, so the next query asks upstream again. If the TLS server cannot list the changes, the
+    whole zone is dropped. The number of dropped names is in the server stats (invalidated). Names of a zone may be
+    cached (default.dat, a snapshot) before its TLS server is known, so the first poll of a zone, which has no serial
+    to ask from, drops every cached name of the zone. A newly learned zone is polled at once, on the zone thread and
+    never on the path of a query.
+#   20. Zone preloading (zone_transfer.py): the zones listed in a zone file (--zones ./data/zones.dat) are transferred
+    from their TLS servers in bulk when the server starts and again every zone_refresh_interval seconds, so their
+    names are cache hits without a miss each. A transfer also sets the zone serial, so later changes are dropped as
+    in 19. In cluster mode a node only keeps the names it owns.
+#   21. Answers to clients carry the seconds they stay fresh: <0x00, {id}, ip, ttl>, the time left of the cache entry
+    (0 for a stale answer), so clients can cache them (dns_common/client_cache.py). Answers to peers do not, because
+    a peer reads a 4th field of an answer as an alias chain.
+#   22. Pipelined sessions (pipeline.py): a client which sends newline terminated queries tagged with request IDs
+    (<id, domain, method, request_id>) gets tagged responses as they complete. Cache hits are answered on the session
+    thread at once; misses go to a pool of miss_workers threads (at most miss_queue waiting, then "Server busy"), so
+    hits never wait behind a slow upstream server. Sessions without tags are answered in order as before.
+#   23. --reuse-port lets several worker processes (supervisor/supervisor.py) listen on the same TCP and UDP port. Each
+    worker has its own cache; give each one its own --id, so logs and snapshots do not mix.
 
 """
 
 
 import os
+import sys
 import time
+import signal
 import socket
+import argparse
 import threading
 
+from cache import DNSCache
+from admission import AdmissionController
+from cluster import Cluster, read_peer_file
+from zone_transfer import read_zone_file, transfer_zone
+from pipeline import TaggedConnection, WorkerPool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common.trace import Tracer
+from dns_common.querylog import QueryLog
+from dns_common.replay import CaptureWriter
+from dns_common import codec
+
 
 class DNSDefaultServer:
 
-    def __init__(self, id_, port_, default_file):
+    def __init__(self, id_, port_, default_file, backlog=128, max_sessions=64, max_inflight=32, rate=20.0,
+                 burst=40, drain_timeout=5.0, snapshot_file='./data/default.snap', snapshot_interval=60.0,
+                 cache_ttl=3600, trace_sample=0.01, capture_file=None, udp_workers=8, udp_payload_size=512,
+                 cluster=None, stale_grace=3600, stale_budget=0.5, max_alias_depth=8, zone_servers=None,
+                 zone_poll_interval=5.0, preload_zones=None, zone_refresh_interval=300.0, miss_workers=32,
+                 miss_queue=256, reuse_port=False):
         address_ = ('127.0.0.1', port_)
         
         self.id = id_
         self.default_file = default_file
 
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server_socket.bind(address_)
-        self.server_socket.listen(5)
+        self.server_socket.listen(backlog)
+
+        '''UDP front end on the same address. The timeout lets the workers notice shutdown.'''
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.udp_socket.bind(address_)
+        self.udp_socket.settimeout(0.5)
+        self.udp_workers = udp_workers
+        self.udp_payload_size = udp_payload_size
+
+        '''Cluster mode: peers send the misses of names this node owns to its peer port.'''
+        self.cluster = cluster
+        self.peer_socket = None
+        if cluster is not None:
+            self.peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.peer_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.peer_socket.bind(cluster.address)
+            self.peer_socket.listen(backlog)
+
+        self.admission = AdmissionController(max_sessions, max_inflight, rate, burst)
+        '''Misses of pipelined sessions are resolved by this pool, their hits on the session thread.'''
+        self.miss_pool = WorkerPool(miss_workers, miss_queue)
 
         self.root_address = ('127.0.0.1', 5353)
         self.msg_size = 64 * 1024
-
-        self.dns_cache = self.build_default_cache(default_file)
+        self.encoder = codec.MessageEncoder(self.id)
+        '''parsed_queries: codec.ParseCache of the parsed queries, clients repeat the same queries'''
+        self.parsed_queries = codec.ParseCache()
+
+        self.snapshot_file = snapshot_file
+        self.snapshot_interval = snapshot_interval
+        self.dns_cache = self.build_default_cache(snapshot_file, default_file, cache_ttl, stale_grace)
+
+        '''Serve-stale: refreshing: formatted as {domain: {'done': Event, 'response': parsed response}}'''
+        self.stale_grace = stale_grace
+        self.stale_budget = stale_budget
+        self.refreshing = {}
+        self.refresh_lock = threading.Lock()
+        self.stale_served = 0
+
+        self.max_alias_depth = max_alias_depth
+
+        '''Zone changes: zone_servers: formatted as {tld: (ip, port)}, zone_serials: formatted as {tld: serial}'''
+        self.zone_servers = dict(zone_servers) if zone_servers else {}
+        self.zone_serials = {}
+        self.zone_poll_interval = zone_poll_interval
+        self.zone_wakeup = threading.Event()
+        self.invalidated = 0
+        '''alias_dependents: formatted as {name: set(aliases cached with its address)}'''
+        self.alias_dependents = {}
+        self.alias_lock = threading.Lock()
+
+        '''Zone preloading: preload_zones: formatted as [(tld, (ip, port), prefix), ]'''
+        self.preload_zones = list(preload_zones) if preload_zones else []
+        self.zone_refresh_interval = zone_refresh_interval
+        self.preloaded = 0
+        for tld, address, prefix in self.preload_zones:
+            self.zone_servers.setdefault(tld, address)
         
         '''client_connection_list: formatted as [(connection, address), ], i.e. the return of accept'''
         self.client_connection_list = []
-        self.client_connection_thread_list = []
 
         self.server_shutdown = False
+        self.drain_timeout = drain_timeout
 
         self.log_dir = './log/{0}.log'.format(self.id)
+        self.tracer = Tracer(self.id, './log/{0}.trace'.format(self.id), trace_sample)
+        self.query_log = QueryLog('./log/{0}.qlog'.format(self.id))
+        self.capture = CaptureWriter(capture_file) if capture_file is not None else None
 
     @staticmethod
-    def build_default_cache(file):
-        cache = {}
-        with open(file) as f:
-            data = f.readlines()
-        for line in data:
-            line_list = line.strip().split()
-            cache[line_list[0].lower()] = line_list[1]
-        return cache
+    def build_default_cache(snapshot_file, default_file, ttl, stale_grace=0):
+        return DNSCache.load(snapshot_file, default_file, ttl, stale_grace)
 
     def accept(self):
         return self.server_socket.accept()
 
     def recv_query(self, connection_):
+        """Return the received bytes, b'' if the connection is lost. The query is logged when it is handled."""
         try:
             data = connection_.recv(self.msg_size)
-        except ConnectionResetError:
+        except OSError:
+            '''ConnectionResetError, or the connection has been closed by shutdown().'''
             connection_.close()
-            return ''
+            return b''
+        return data
 
-        query_ = str(data, encoding='utf-8')
-        if query_ != "HEARTBEAT_PACKET_ASK":
-            self.write_log(query_[1:-1] + '\n')
-        return query_
+    def cache_ttl(self, domain):
+        """Seconds the cached answer of domain (or www.domain) stays fresh."""
+        if domain.startswith('www.'):
+            other = domain[4:]
+        else:
+            other = 'www.' + domain
+        return max(self.dns_cache.remaining(domain), self.dns_cache.remaining(other))
+
+    def answer_message(self, ip, ttl, forward=True):
+        '''Clients get the TTL of the answer as a 4th field; peers (forward=False) read a 4th field as a chain.'''
+        if forward:
+            return self.encoder.answer_ttl(ip, ttl)
+        return self.encoder.answer(ip)
 
-    def cache_query(self, domain):
+    def cache_query(self, domain, stale=False):
+        get = self.dns_cache.get_stale if stale else self.dns_cache.get
         domain_list = domain.split('.')
         if domain_list[0] != 'www':
             q1 = '.'.join(['www'] + domain_list)
@@ -95,8 +240,8 @@ class DNSDefaultServer:
         else:
             q1 = domain
             q2 = '.'.join(domain_list[1:])
-        result1 = self.dns_cache.get(q1, '')
-        result2 = self.dns_cache.get(q2, '')
+        result1 = get(q1, '')
+        result2 = get(q2, '')
         if result1 == '':
             return result2
         else:
@@ -105,226 +250,624 @@ class DNSDefaultServer:
     def set_shutdown(self):
         self.server_shutdown = True
 
+    def shutdown(self):
+        '''Stop accepting, drain in-flight resolutions, then close every session at once.'''
+        self.set_shutdown()
+        self.server_socket.close()
+        if self.peer_socket is not None:
+            self.peer_socket.close()
+
+        if not self.admission.wait_idle(self.drain_timeout):
+            print('Drain timeout: {0} resolutions still in flight.'.format(self.admission.stats()['inflight']))
+        '''Closed after draining, so the answers of in-flight UDP queries can still be sent.'''
+        self.udp_socket.close()
+
+        for connection, address in list(self.client_connection_list):
+            try:
+                connection.sendto(bytes("SERVER_SHUTDOWN: CONNECTION CLOSE", encoding="utf-8"), address)
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+            self.write_log("SERVER_SHUTDOWN: CONNECTION CLOSE: {0}. {1}".format(address[0], address[1]) + '\n\n')
+
+        self.write_cache()
+        self.query_log.close()
+        if self.capture is not None:
+            self.capture.close()
+
     def write_log(self, msg):
         with open(self.log_dir, 'a', encoding='utf-8') as f:
             f.write(msg)
 
-    def write_cache(self):
-        with open(self.default_file, 'w', encoding='utf-8') as f:
-            for domain, ip in self.dns_cache.items():
-                f.write('{0} {1}\n'.format(domain, ip))
+    def send_response(self, connection, address, send_msg):
+        if connection is self.udp_socket and len(send_msg) > self.udp_payload_size:
+            '''Too large for one datagram: the client has to ask again over TCP.'''
+            send_msg = self.encoder.truncated()
+        connection.sendto(send_msg, address)
 
-    def resolve_query(self, query, connection, address):
-        query_list = query[1:-1].split(',')
-        if len(query_list) != 3:
-            send_msg = "<0xEE, {0}, {1}>".format(self.id, "Invalid format")
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+        self.write_log(codec.log_line(send_msg))
 
-            self.write_log(send_msg[1:-1] + '\n')
-            return None
+    def send_busy(self, connection, address, reason=codec.SERVER_BUSY):
+        try:
+            self.send_response(connection, address, self.encoder.busy(reason))
+        except OSError:
+            pass
+
+    def stats_message(self):
+        stats = self.admission.stats()
+        stats['stale_served'] = self.stale_served
+        stats['invalidated'] = self.invalidated
+        stats['preloaded'] = self.preloaded
+        stats.update(self.miss_pool.stats())
+        if self.cluster is not None:
+            stats.update(self.cluster.stats())
+        return "SERVER_STATS_ACK: " + ', '.join('{0}={1}'.format(key, value) for key, value in stats.items())
 
-        domain = query_list[1].strip()
-        method = query_list[2].strip()
+    def write_cache(self):
+        self.dns_cache.save(self.snapshot_file)
+
+    def snapshot_loop(self):
+        while not self.server_shutdown:
+            time.sleep(self.snapshot_interval)
+            if self.dns_cache.dirty and not self.server_shutdown:
+                self.write_cache()
+
+    def start_snapshot_thread(self):
+        snapshot_thread = threading.Thread(target=self.snapshot_loop)
+        snapshot_thread.daemon = True
+        snapshot_thread.start()
+
+    def start_zone_thread(self):
+        zone_thread = threading.Thread(target=self.zone_loop)
+        zone_thread.daemon = True
+        zone_thread.start()
+
+    def zone_loop(self):
+        while not self.server_shutdown:
+            '''A newly learned zone wakes the loop, so its first poll comes at once.'''
+            self.zone_wakeup.wait(self.zone_poll_interval)
+            self.zone_wakeup.clear()
+            for tld, address in list(self.zone_servers.items()):
+                if self.server_shutdown:
+                    break
+                try:
+                    self.poll_zone(tld, address)
+                except OSError:
+                    '''The TLS server is down: its names are kept until it is back or their TTL runs out.'''
+                    pass
+
+    def poll_zone(self, tld, address):
+        """Ask the TLS server of tld for the names changed since the last serial and drop them from the cache.
+        Without a serial the changes cannot be listed, so every cached name of the zone is dropped."""
+        since = self.zone_serials.get(tld, -1)
+        connection = socket.create_connection(address, timeout=4)
+        try:
+            connection.sendall(bytes('ZONE_CHANGES_ASK {0}'.format(since), encoding='utf-8'))
+            data = b''
+            while True:
+                chunk = connection.recv(self.msg_size)
+                if chunk == b'':
+                    break
+                data += chunk
+        finally:
+            connection.close()
 
+        reply = str(data, encoding='utf-8').split()
+        if len(reply) < 3 or reply[0] != 'ZONE_CHANGES_ACK':
+            return
+        serial, full, names = int(reply[1]), reply[2] == '1', reply[3:]
+        if since < 0:
+            dropped = self.invalidate_zone(tld)
+            self.invalidated += dropped
+            print('zone {0}: first serial {1}, {2} cached names dropped'.format(tld, serial, dropped))
+        elif since >= 0 and serial != since:
+            if full:
+                dropped = self.invalidate_zone(tld)
+            else:
+                dropped = sum(self.invalidate_name(name) for name in names)
+            self.invalidated += dropped
+            print('zone {0}: serial {1} -> {2}, {3} cached names dropped'.format(tld, since, serial, dropped))
+        self.zone_serials[tld] = serial
+
+    def invalidate_name(self, name):
+        """Drop name, www.name and every alias cached with the address of name. Return the number of names dropped."""
+        bare = name[4:] if name.startswith('www.') else name
+        with self.alias_lock:
+            dependents = self.alias_dependents.pop(bare, ())
+        dropped = self.dns_cache.invalidate(bare) + self.dns_cache.invalidate('www.' + bare)
+        return dropped + sum(self.dns_cache.invalidate(alias) for alias in dependents)
+
+    def invalidate_zone(self, tld):
+        """Drop every name of the zone tld and the aliases, in any zone, cached with their addresses."""
+        suffix = '.' + tld
+        with self.alias_lock:
+            targets = [name for name in self.alias_dependents if name.endswith(suffix)]
+        return self.dns_cache.invalidate_zone(tld) + sum(self.invalidate_name(name) for name in targets)
+
+    def preload_zone(self, tld, address, prefix=''):
+        """Transfer a zone from its TLS server into the cache. Return the number of names cached."""
+        def store(name, ip):
+            if self.cluster is None or self.cluster.is_owner(name):
+                self.dns_cache.set(name, ip)
+                stored.append(name)
+
+        stored = []
+        start = time.time()
+        try:
+            serial, count = transfer_zone(address, prefix, store, self.msg_size)
+        except (OSError, ValueError) as e:
+            print('zone {0}: transfer failed after {1} names: {2}'.format(tld, len(stored), e))
+            return len(stored)
+
+        if tld not in self.zone_serials or serial > self.zone_serials[tld]:
+            self.zone_serials[tld] = serial
+        self.preloaded += len(stored)
+        print('zone {0}: {1} of {2} names preloaded (serial {3}) in {4:.3f} s'.format(
+            tld, len(stored), count, serial, time.time() - start))
+        return len(stored)
+
+    def preload(self):
+        for tld, address, prefix in self.preload_zones:
+            self.preload_zone(tld, address, prefix)
+
+    def preload_loop(self):
+        while not self.server_shutdown:
+            time.sleep(self.zone_refresh_interval)
+            if not self.server_shutdown:
+                self.preload()
+
+    def start_preload_thread(self):
+        if self.preload_zones:
+            preload_thread = threading.Thread(target=self.preload_loop)
+            preload_thread.daemon = True
+            preload_thread.start()
+
+    def start_peer_thread(self):
+        if self.peer_socket is not None:
+            peer_thread = threading.Thread(target=serve_peers, args=(self,))
+            peer_thread.daemon = True
+            peer_thread.start()
+
+    def start_miss_workers(self):
+        self.miss_pool.start()
+
+    def start_udp_threads(self):
+        for _ in range(self.udp_workers):
+            udp_thread = threading.Thread(target=serve_datagrams, args=(self,))
+            udp_thread.daemon = True
+            udp_thread.start()
+
+    def answers_now(self, query):
+        """True if a query (text of codec.decode) needs no upstream server: it is invalid or its answer is cached."""
+        parsed = codec.parse_query(query, self.parsed_queries)
+        return parsed is None or self.cache_query(parsed[1]) != ''
+
+    def resolve_query(self, query, connection, address, arrived=None):
+        if arrived is None:
+            arrived = time.time()
+
+        parsed = codec.parse_query(query, self.parsed_queries)
         valid_set = {'com', 'gov', 'org'}
-        if domain.split('.')[-1].strip() not in valid_set:
-            send_msg = "<0xEE, {0}, {1}>".format(self.id, "Invalid format")
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
-
-            self.write_log(send_msg[1:-1] + '\n')
+        if parsed is None or parsed[3] is not None or parsed[1].split('.')[-1] not in valid_set or \
+                parsed[2] not in ('R', 'I'):
+            self.send_response(connection, address, self.encoder.invalid())
+            self.query_log.write(address[0], query, '', codec.CODE_INVALID, time.time() - arrived, None, arrived)
             return None
 
-        if method != 'R' and method != 'I':
-            send_msg = "<0xEE, {0}, {1}>".format(self.id, "Invalid format")
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+        client, domain, method, _ = parsed
 
-            self.write_log(send_msg[1:-1] + '\n')
-            return None
-        
-        result = self.cache_query(domain)
+        span = self.tracer.span(self.tracer.new_trace_id(), domain, arrived)
+        span.start()
+        code, cache_hit = self.resolve_domain(domain, method, connection, address, span)
+        span.finish(code)
+        self.query_log.write(client, domain, method, code, time.time() - arrived, cache_hit, arrived)
 
-        if result != '':
-            send_msg = "<0x00, {0}, {1}>".format(self.id, result)
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+    def resolve_peer_query(self, query, connection, address, arrived=None):
+        '''A miss forwarded by a peer: <node_id, domain, method[, trace_id]>. It is never forwarded again.'''
+        if arrived is None:
+            arrived = time.time()
 
-            self.write_log(send_msg[1:-1] + '\n')
+        parsed = codec.parse_query(query)
+        valid_set = {'com', 'gov', 'org'}
+        if parsed is None or parsed[1].split('.')[-1] not in valid_set or parsed[2] not in ('R', 'I'):
+            self.send_response(connection, address, self.encoder.invalid())
+            return None
 
-        else:
-            '''recursively or iteratively ask root DNS'''
-            try:
-                client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                client_socket.settimeout(4)
-                client_socket.connect(self.root_address)
-                send_msg = "<{0}, {1}, {2}>".format(self.id, domain, method)
-                client_socket.sendall(bytes(send_msg, encoding="utf-8"))
+        node_id, domain, method, trace_id = parsed
+        self.cluster.served += 1
 
-                self.write_log(send_msg[1:-1] + '\n')
+        span = self.tracer.span(trace_id, domain, arrived)
+        span.start()
+        code, cache_hit = self.resolve_domain(domain, method, connection, address, span, forward=False)
+        span.finish(code)
+        self.query_log.write(node_id, domain, method, code, time.time() - arrived, cache_hit, arrived)
 
-                ret_bytes = client_socket.recv(self.msg_size)
-                response_msg = str(ret_bytes, encoding="utf-8")
+    def resolve_domain(self, domain, method, connection, address, span, forward=True):
+        """Answer a valid query from the cache, the owner peer or the upstream servers.
+        Return (response code, answered from cache)."""
+        result = self.cache_query(domain)
 
-                self.write_log(response_msg[1:-1] + '\n')
+        if result != '':
+            self.send_response(connection, address, self.answer_message(result, self.cache_ttl(domain), forward))
+            return codec.CODE_OK, True
 
-            except ConnectionResetError:
-                send_msg = "<0xFF, {0}, {1}>".format(self.id, "Host not found")
-                connection.sendto(bytes(send_msg, encoding="utf-8"), address)
-                print('ConnectionResetError')
+        stale = self.cache_query(domain, stale=True) if self.stale_grace > 0 else ''
+        if stale != '':
+            return self.resolve_stale(domain, method, stale, connection, address, span, forward)
 
-                self.write_log(send_msg[1:-1] + '\n')
-                return None
+        if not self.admission.acquire_inflight():
+            self.send_busy(connection, address)
+            return codec.CODE_BUSY, False
+        try:
+            response_list = self.fetch(domain, method, span, forward)
+        finally:
+            self.admission.release_inflight()
+
+        if response_list is None:
+            return self.send_not_found(connection, address), False
+        code = response_list[0]
+        self.send_response(connection, address, self.fetched_message(response_list, forward))
+        return code, False
+
+    def fetched_message(self, response_list, forward=True):
+        if response_list[0] == codec.CODE_OK:
+            return self.answer_message(response_list[2], self.dns_cache.ttl, forward)
+        return self.encoder.response(response_list[0], response_list[2])
+
+    def resolve_stale(self, domain, method, stale, connection, address, span, forward):
+        '''The entry has expired within the grace window: refresh it in the background and wait at most stale_budget
+        seconds for the fresh answer. If the refresh fails or is slower, the stale answer is sent.'''
+        refresh = None
+        if self.admission.acquire_inflight():
+            with self.refresh_lock:
+                if domain not in self.refreshing:
+                    self.refreshing[domain] = refresh = {'done': threading.Event(), 'response': None}
+            if refresh is None:
+                '''Another thread is refreshing this name already.'''
+                self.admission.release_inflight()
+            else:
+                refresh_thread = threading.Thread(target=self.refresh_entry,
+                                                  args=(domain, method, span, forward, refresh))
+                refresh_thread.daemon = True
+                refresh_thread.start()
+
+        if refresh is not None and refresh['done'].wait(self.stale_budget):
+            response_list = refresh['response']
+            if response_list is not None and response_list[0] not in (codec.CODE_BUSY, codec.CODE_INVALID):
+                code = response_list[0]
+                self.send_response(connection, address, self.fetched_message(response_list, forward))
+                return code, False
+
+        self.stale_served += 1
+        self.send_response(connection, address, self.answer_message(stale, 0, forward))
+        return codec.CODE_OK, True
+
+    def refresh_entry(self, domain, method, span, forward, refresh):
+        try:
+            refresh['response'] = self.fetch(domain, method, span, forward)
+        finally:
+            with self.refresh_lock:
+                del self.refreshing[domain]
+            self.admission.release_inflight()
+            refresh['done'].set()
+
+    def fetch(self, domain, method, span, forward=True):
+        """Resolve domain and the aliases it leads to. Return the final response (code, id, value[, chain]), or None if
+        no server could answer. Every name of an alias chain is cached with the final address."""
+        chain = []
+        name = domain
+        response_list = self.fetch_name(name, method, span, forward)
+        while response_list is not None and response_list[0] == codec.CODE_ALIAS:
+            '''The TLS server followed the aliases of its zone up to target, which is in another zone.'''
+            chain.extend(codec.parse_chain(response_list[3])[:-1])
+            name = response_list[2]
+            if name in chain:
+                return codec.CODE_NOT_FOUND, self.id, codec.ALIAS_LOOP
+            if len(chain) > self.max_alias_depth:
+                return codec.CODE_NOT_FOUND, self.id, codec.ALIAS_TOO_DEEP
+            response_list = self.fetch_name(name, method, span, forward)
+
+        if response_list is None or response_list[0] != codec.CODE_OK:
+            return response_list
+        chain.extend(codec.parse_chain(response_list[3]) if len(response_list) == 4 else [name])
+        self.cache_answer(chain, response_list[2])
+        if len(chain) > 1:
+            return codec.CODE_OK, response_list[1], response_list[2], ' '.join(chain)
+        return response_list
+
+    def cache_answer(self, chain, ip):
+        '''In cluster mode a node only caches the names it owns.'''
+        for name in chain:
+            if self.cluster is None or self.cluster.is_owner(name):
+                self.dns_cache[name] = ip
+        '''Every name of the chain depends on the names after it: a change of any of them, even in another zone, must
+        drop it too.'''
+        if len(chain) > 1:
+            with self.alias_lock:
+                for index in range(1, len(chain)):
+                    target = chain[index][4:] if chain[index].startswith('www.') else chain[index]
+                    self.alias_dependents.setdefault(target, set()).update(chain[:index])
+
+    def fetch_name(self, domain, method, span, forward=True):
+        """Ask the owner peer or the upstream servers for one name. Return the final response, or None."""
+        if forward and self.cluster is not None:
+            owner = self.cluster.owner(domain)
+            if owner != self.cluster.node_id:
+                response_list = self.fetch_peer(owner, domain, method, span)
+                if response_list is not None:
+                    return response_list
+        return self.fetch_upstream(domain, method, span)
+
+    def fetch_peer(self, owner, domain, method, span):
+        '''Ask the owner of domain. Return None if the owner cannot be reached, then the caller goes upstream.'''
+        try:
+            response_list = self.ask_upstream(self.cluster.peers[owner], domain, method, span)
+        except OSError:
+            '''ConnectionRefusedError, ConnectionResetError or socket.timeout: the owner is down.'''
+            self.cluster.mark_down(owner)
+            return None
+        if response_list is None or response_list[0] == codec.CODE_REFERRAL:
+            self.cluster.mark_down(owner)
+            return None
 
-            except ConnectionRefusedError:
-                send_msg = "<0xFF, {0}, {1}>".format(self.id, "Host not found")
-                connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+        self.cluster.forwarded += 1
+        return response_list
 
-                self.write_log(send_msg[1:-1] + '\n')
-                return None
+    def ask_upstream(self, next_address, domain, method, span):
+        """Send one query to an upstream server and return its parsed response. Socket errors are raised."""
+        span.upstream_begin()
+        try:
+            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client_socket.settimeout(4)
+            try:
+                client_socket.connect(next_address)
+                send_msg = self.encoder.query(domain, method, span.trace_id)
+                client_socket.sendall(send_msg)
 
-            except socket.timeout:
-                send_msg = "<0xFF, {0}, {1}>".format(self.id, "Host not found")
-                connection.sendto(bytes(send_msg, encoding="utf-8"), address)
-                print('timeout')
+                self.write_log(codec.log_line(send_msg))
 
-                self.write_log(send_msg[1:-1] + '\n')
-                return None
+                '''Wait for response'''
+                response_msg = client_socket.recv(self.msg_size)
+            finally:
+                client_socket.close()
+        finally:
+            span.upstream_end()
 
-            if method == 'R':
-                '''Recursive query, the result is the final answer.'''
-                response_msg_from_root = response_msg
-                response_msg_from_root_list = response_msg_from_root[1:-1].split(',')
-                code = response_msg_from_root_list[0].strip()
+        self.write_log(codec.log_line(response_msg))
+        return codec.parse_response(response_msg)
 
-                if code == '0x00':
-                    ip = response_msg_from_root_list[2].strip()
-                    self.dns_cache[domain] = ip
-                    self.write_cache()
+    def send_not_found(self, connection, address):
+        self.send_response(connection, address, self.encoder.not_found())
+        return codec.CODE_NOT_FOUND
 
-                send_msg = "<{0}, {1}, {2}>".format(code, self.id, response_msg_from_root_list[2].strip())
-                connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+    def fetch_upstream(self, domain, method, span):
+        '''recursively or iteratively ask root DNS'''
+        try:
+            response_list = self.ask_upstream(self.root_address, domain, method, span)
 
-                self.write_log(send_msg[1:-1] + '\n')
-                
-            elif method == "I":
+            if method == "I":
                 '''Iterative query, the result is the next query address'''
-                response_msg_list = response_msg[1:-1].split(',')
-                code = response_msg_list[0].strip()
-
-                while code != '0x00' and code != '0xFF':
-                    next_address = (response_msg_list[2].strip(), int(response_msg_list[3].strip()))
-
-                    try:
-                        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        client_socket.settimeout(4)
-                        client_socket.connect(next_address)
-                        send_msg = "<{0}, {1}, {2}>".format(self.id, domain, method)
-                        client_socket.sendall(bytes(send_msg, encoding="utf-8"))
-
-                        self.write_log(send_msg[1:-1] + '\n')
-
-                        '''Wait for response'''
-                        response_msg = str(client_socket.recv(self.msg_size), encoding="utf-8")
-
-                        self.write_log(response_msg[1:-1] + '\n')
-
-                    except ConnectionResetError:
-                        send_msg = "<0xFF, {0}, {1}>".format(self.id, "Host not found")
-                        connection.sendto(bytes(send_msg, encoding="utf-8"), address)
-
-                        self.write_log(send_msg[1:-1] + '\n')
-
-                        return None
-                    except ConnectionRefusedError:
-                        send_msg = "<0xFF, {0}, {1}>".format(self.id, "Host not found")
-                        connection.sendto(bytes(send_msg, encoding="utf-8"), address)
-
-                        self.write_log(send_msg[1:-1] + '\n')
-
-                        return None
-                    except socket.timeout:
-                        send_msg = "<0xFF, {0}, {1}>".format(self.id, "Host not found")
-                        connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+                while response_list is not None and response_list[0] == codec.CODE_REFERRAL:
+                    next_address = (response_list[2], int(response_list[3]))
+                    if next_address not in self.zone_servers.values():
+                        '''The first referral (from the root) is the TLS server of the zone: poll it for changes.'''
+                        self.zone_servers.setdefault(domain.split('.')[-1], next_address)
+                        self.zone_wakeup.set()
+                    response_list = self.ask_upstream(next_address, domain, method, span)
+
+        except OSError:
+            '''ConnectionResetError, ConnectionRefusedError or socket.timeout'''
+            return None
 
-                        self.write_log(send_msg[1:-1] + '\n')
+        '''Recursive query, or jump from while loop: the result must be the final response.'''
+        if response_list is None or response_list[0] == codec.CODE_REFERRAL:
+            return None
+        return response_list
 
-                        return None
 
-                    response_msg_list = response_msg[1:-1].split(',')
-                    code = response_msg_list[0].strip()
+def process_connection(server, connection, address):
+    server.client_connection_list.append((connection, address))
+    print('accept: {0}, {1}'.format(address[0], address[1]))
+    try:
+        serve_connection(server, connection, address)
+    finally:
+        server.client_connection_list.remove((connection, address))
+        server.admission.release_session()
 
-                '''When jump from while loop, the result must be the final response.'''
-                if code == '0x00':
-                    ip = response_msg_list[2].strip()
-                    self.dns_cache[domain] = ip
-                    self.write_cache()
 
-                send_msg = "<{0}, {1}, {2}>".format(code, self.id, response_msg_list[2].strip())
-                connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+def serve_connection(server, connection, address):
+    '''On shutdown the server closes the connection, so recv_query returns '' and the loop ends by itself.'''
+    while True:
+        query = server.recv_query(connection)
+        arrived = time.time()
+        if query == b'':
+            if not server.server_shutdown:
+                print('Loss connection: {0}, {1}'.format(address[0], address[1]))
+            break
+        if query == b'q':
+            print('close: {0}, {1}'.format(address[0], address[1]))
+            connection.close()
+            break
+        if b'\n' in query:
+            serve_pipelined(server, connection, address, query)
+            break
+        handle_message(server, query, connection, address, arrived)
+
+
+def serve_pipelined(server, connection, address, data):
+    '''The client sends newline terminated lines and does not wait for the answers, so one recv may hold several
+    lines and the end of a line may come with the next recv.'''
+    lock = threading.Lock()
+    buffer = b''
+    while data != b'':
+        arrived = time.time()
+        lines = (buffer + data).split(b'\n')
+        buffer = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line == b'q':
+                print('close: {0}, {1}'.format(address[0], address[1]))
+                connection.close()
+                return
+            if line:
+                dispatch_line(server, line, connection, lock, address, arrived)
+        data = server.recv_query(connection)
+    if not server.server_shutdown:
+        print('Loss connection: {0}, {1}'.format(address[0], address[1]))
+
+
+def dispatch_line(server, line, connection, lock, address, arrived):
+    '''A tagged query is answered at once if it is a hit, by the miss pool otherwise. Other lines in order; a line
+    which only looks tagged (<a, b, c, 1 without the bracket) is answered in order as invalid.'''
+    untagged = codec.untag(line) if line.startswith(b'<') and line.count(b',') == 3 else None
+    if untagged is not None:
+        request_id, query = untagged
+        tagged = TaggedConnection(connection, lock, request_id)
+        text = codec.decode(query)
+        if server.answers_now(text):
+            handle_message(server, query, tagged, address, arrived, text)
+        elif not server.miss_pool.submit(handle_message, (server, query, tagged, address, arrived, text)):
+            server.write_log(codec.log_line(text))
+            server.send_busy(tagged, address)
+            server.write_log('\n')
+    else:
+        handle_message(server, line, TaggedConnection(connection, lock), address, arrived)
+
+
+def serve_datagrams(server):
+    '''One UDP worker: every datagram is a whole query. The workers share the UDP socket.'''
+    while not server.server_shutdown:
+        try:
+            query, address = server.udp_socket.recvfrom(server.msg_size)
+        except socket.timeout:
+            continue
+        except OSError:
+            break
+        arrived = time.time()
 
-                self.write_log(send_msg[1:-1] + '\n')
+        try:
+            handle_message(server, query, server.udp_socket, address, arrived)
+        except OSError:
+            '''The UDP socket has been closed by shutdown().'''
+            break
+        except ValueError as e:
+            '''A malformed datagram must never stop the worker.'''
+            print('bad datagram from {0}: {1!r}'.format(address[0], e))
 
-            else:
-                send_msg = "<0xEE, {0}, {1}>".format(self.id, "Invalid format")
-                connection.sendto(bytes(send_msg, encoding="utf-8"), address)
 
-                self.write_log(send_msg[1:-1] + '\n')
-                return None
+def serve_peers(server):
+    '''Accept loop of the peer port. Peers are trusted: no session or rate limit, but misses still count in flight.'''
+    while not server.server_shutdown:
+        try:
+            connection, address = server.peer_socket.accept()
+        except OSError:
+            break
+        peer_thread = threading.Thread(target=serve_peer_connection, args=(server, connection, address))
+        peer_thread.daemon = True
+        peer_thread.start()
 
 
-def process_connection(server):
-    connection, address = server.accept()
-    server.client_connection_list.append((connection, address))
-    print('accept: {0}, {1}'.format(address[0], address[1]))
+def serve_peer_connection(server, connection, address):
     while True:
-        if server.server_shutdown:
-            '''Sever shutdown because of interruption. It will broadcast a message and close all connection'''
-            connection.sendto(bytes("SERVER_SHUTDOWN: CONNECTION CLOSE", encoding="utf-8"), address)
-            server.write_log("SERVER_SHUTDOWN: CONNECTION CLOSE: {0}. {1}".format(address[0], address[1]) + '\n\n')
-
-            time.sleep(5)
+        query = server.recv_query(connection)
+        arrived = time.time()
+        if query == b'' or query == b'q':
             connection.close()
             break
+        if query == b"HEARTBEAT_PACKET_ASK":
+            connection.sendto(bytes("HEARTBEAT_PACKET_ACK", encoding="utf-8"), address)
         else:
-            query = server.recv_query(connection)
-            if query == '':
-                print('Loss connection: {0}, {1}'.format(address[0], address[1]))
-                break
-            if query == 'q':
-                print('close: {0}, {1}'.format(address[0], address[1]))
-                connection.close()
-                break
-            if query == "HEARTBEAT_PACKET_ASK":
-                ''' This is for heartbeat protocol, which follows the traditional TCP.'''
-                connection.sendto(bytes("HEARTBEAT_PACKET_ACK", encoding="utf-8"), address)
-                pass
+            text = codec.decode(query)
+            server.write_log(codec.log_line(text))
+            server.resolve_peer_query(text, connection, address, arrived)
+            server.write_log('\n')
+
+
+def handle_message(server, query, connection, address, arrived, text=None):
+    '''Answer one message from a TCP session or a UDP datagram. connection.sendto works for both.
+    The query is decoded once (text, unless the caller has done it) for the log, the capture and the parser.'''
+    if query == b"HEARTBEAT_PACKET_ASK":
+        ''' This is for heartbeat protocol, which follows the traditional TCP.'''
+        connection.sendto(bytes("HEARTBEAT_PACKET_ACK", encoding="utf-8"), address)
+        return
+    if query == b"SERVER_STATS_ASK":
+        connection.sendto(bytes(server.stats_message(), encoding="utf-8"), address)
+        return
+
+    if text is None:
+        text = codec.decode(query)
+    server.write_log(codec.log_line(text))
+    if server.capture is not None:
+        '''Before the rate limit, so a replay sends the refused queries too, and over the transport they came by.'''
+        server.capture.write(address, text, arrived, 'udp' if connection is server.udp_socket else 'tcp')
+    if not server.admission.allow_query(address[0]):
+        server.send_busy(connection, address, codec.RATE_LIMITED)
+        server.write_log('\n')
+        server.query_log.write(address[0], text, '', codec.CODE_BUSY, time.time() - arrived, None, arrived)
+
+    else:
+        server.resolve_query(text, connection, address, arrived)
+        server.write_log('\n')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='DNS default local server.')
+    parser.add_argument('--id', default='Local_DNS_Server')
+    parser.add_argument('--port', type=int, default=5352)
+    parser.add_argument('--peers', help='peer list of cluster mode, e.g. ./data/peers.dat (the id must be in it)')
+    parser.add_argument('--snapshot', help='cache snapshot, default ./data/default.snap or ./data/{id}.snap')
+    parser.add_argument('--zones', help='zones to preload from their TLS servers, e.g. ./data/zones.dat')
+    parser.add_argument('--reuse-port', action='store_true', help='share the port with other local server workers')
+    parser.add_argument('--backlog', type=int, default=128, help='connections waiting to be accepted')
+    parser.add_argument('--max-sessions', type=int, default=64, help='concurrent client sessions')
+    parser.add_argument('--max-inflight', type=int, default=32, help='concurrent upstream resolutions')
+    parser.add_argument('--rate', type=float, default=20.0, help='queries per second of a client address, 0: no limit')
+    parser.add_argument('--burst', type=int, default=40, help='queries a client address may send at once')
+    parser.add_argument('--capture', help='record every client query to this file for dns_common/replay.py')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    cluster = Cluster(args.id, read_peer_file(args.peers)) if args.peers else None
+    if args.snapshot is None:
+        args.snapshot = './data/default.snap' if args.id == 'Local_DNS_Server' else './data/{0}.snap'.format(args.id)
+
+    preload_zones = read_zone_file(args.zones) if args.zones else None
+    rate = args.rate if args.rate > 0 else None
+
+    server = DNSDefaultServer(args.id, args.port, './data/default.dat', snapshot_file=args.snapshot, cluster=cluster,
+                              preload_zones=preload_zones, reuse_port=args.reuse_port, backlog=args.backlog,
+                              max_sessions=args.max_sessions, max_inflight=args.max_inflight, rate=rate,
+                              burst=args.burst, capture_file=args.capture)
+    server.preload()
+    server.start_snapshot_thread()
+    server.start_udp_threads()
+    server.start_miss_workers()
+    server.start_peer_thread()
+    server.start_zone_thread()
+    server.start_preload_thread()
+    print("server start!")
+
+    '''SIGTERM (e.g. from a process manager during a rolling restart) drains the server the same way as ctrl + C.'''
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
-            else:
-                server.resolve_query(query, connection, address)
+    while True:
+        try:
+            connection, address = server.accept()
+            if not server.admission.acquire_session():
+                '''Too many sessions: reject the new client at once instead of letting it wait for a thread.'''
+                server.send_busy(connection, address)
                 server.write_log('\n')
+                connection.close()
+                continue
 
-
-server = DNSDefaultServer("Local_DNS_Server", 5352, './data/default.dat')
-print("server start!")
-
-while True:
-    try:
-        '''This design is to avoid to generate thread infinitely.'''
-        if len(server.client_connection_thread_list) == len(server.client_connection_list):
-            connection_thread = threading.Thread(target=process_connection, args=(server, ))
-            connection_thread.daemon = False
+            connection_thread = threading.Thread(target=process_connection, args=(server, connection, address))
+            connection_thread.daemon = True
             connection_thread.start()
 
-            server.client_connection_thread_list.append(connection_thread)
-
-    except SystemExit:
-        server.set_shutdown()
-        time.sleep(5)
-        os._exit(1)
-
-    except KeyboardInterrupt:
-        print("Shutting down sever. Sever will close in 10 seconds.")
-        server.set_shutdown()
-        time.sleep(10)
-        os._exit(1)
-
-
-server.close()
+        except (SystemExit, KeyboardInterrupt):
+            print("Shutting down sever. Sever will close in at most {0} seconds.".format(server.drain_timeout))
+            server.shutdown()
+            sys.exit(0)
@@ -0,0 +1,84 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: pipeline.py
+# description:
+#   1. Pipelined sessions of DNSDefaultServer. A client may send many queries on one connection without waiting, each
+       one tagged with a request ID and ending with a newline: <id, domain, method, request_id>\\n. The responses are
+       sent as they complete, tagged with the same request ID: <code, id, value[, ttl], request_id>\\n, so the client
+       matches them by ID and not by order.
+#   2. A query which can be answered at once (a cache hit or an invalid query) is answered on the session thread. A
+       miss is handed to the shared WorkerPool, so a slow upstream server only holds a worker and never the session:
+       the hits behind it are answered meanwhile.
+#   3. WorkerPool runs n_workers threads on a queue of at most max_queue waiting misses. When the queue is full the
+       miss is answered <0xFE, {id}, "Server busy"> at once instead of waiting.
+#   4. Untagged messages (heartbeat, stats) in a pipelined session are answered in order, also ending with a newline.
+"""
+
+
+import os
+import sys
+import queue
+import threading
+import traceback
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common import codec
+
+
+class TaggedConnection:
+    """Stands in for the connection of a pipelined session: sendto tags the response and writes it under the lock of
+    the session, so responses from several threads never mix."""
+
+    def __init__(self, connection, lock, request_id=None):
+        self.connection = connection
+        self.lock = lock
+        self.request_id = request_id
+
+    def sendto(self, send_msg, address):
+        if self.request_id is not None:
+            send_msg = codec.tag(send_msg, self.request_id)
+        else:
+            send_msg = send_msg + b'\n'
+        with self.lock:
+            self.connection.sendall(send_msg)
+
+
+class WorkerPool:
+
+    def __init__(self, n_workers=32, max_queue=256):
+        self.n_workers = n_workers
+        self.jobs = queue.Queue(max_queue)
+        self.threads = []
+        self.rejected = 0
+
+    def start(self):
+        for _ in range(self.n_workers):
+            worker_thread = threading.Thread(target=self.work)
+            worker_thread.daemon = True
+            worker_thread.start()
+            self.threads.append(worker_thread)
+
+    def submit(self, function, args):
+        """Queue function(*args). Return False if the queue is full."""
+        try:
+            self.jobs.put_nowait((function, args))
+        except queue.Full:
+            self.rejected += 1
+            return False
+        return True
+
+    def work(self):
+        while True:
+            function, args = self.jobs.get()
+            try:
+                function(*args)
+            except OSError:
+                '''The client has gone, or the server is shutting down.'''
+                pass
+            except Exception:
+                traceback.print_exc()
+
+    def stats(self):
+        return {'miss_queue': self.jobs.qsize(), 'miss_rejected': self.rejected}
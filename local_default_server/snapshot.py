@@ -0,0 +1,139 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: snapshot.py
+# description:
+#   1. Binary snapshot of the local server cache (default.snap). Every record keeps the remaining TTL and the number of
+       hits of the entry, so a restarted server neither trusts expired entries nor starts cold.
+#   2. Layout (little endian):
+       header: magic 'DNSC', version (u16), record count (u32), time the snapshot was written (f64)
+       index:  record count * u32 offsets of the records, sorted by domain name
+       record: remaining ttl in seconds (u32), hits (u32), name length (u16), ip length (u8), name, ip
+#   3. The file is opened with mmap and never parsed as a whole. lookup() does a binary search over the index, so the
+       start up time does not grow with the size of the cache.
+"""
+
+
+import os
+import mmap
+import time
+import struct
+
+
+MAGIC = b'DNSC'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHId')
+OFFSET = struct.Struct('<I')
+RECORD = struct.Struct('<IIHB')
+
+MAX_U32 = 0xFFFFFFFF
+
+
+class CacheEntry:
+
+    __slots__ = ('ip', 'expire', 'hits')
+
+    def __init__(self, ip, expire, hits=0):
+        self.ip = ip
+        self.expire = expire
+        self.hits = hits
+
+
+def write_snapshot(file, entries, now=None):
+    """entries: {domain: CacheEntry}. Expired entries are skipped. The file is replaced atomically."""
+    if now is None:
+        now = time.time()
+
+    records = []
+    for domain, entry in entries.items():
+        ttl = int(entry.expire - now)
+        if ttl <= 0:
+            continue
+        records.append((domain.encode('utf-8'), entry.ip.encode('utf-8'), min(ttl, MAX_U32), min(entry.hits, MAX_U32)))
+    records.sort()
+
+    offset = HEADER.size + OFFSET.size * len(records)
+    offsets = []
+    body = []
+    for name, ip, ttl, hits in records:
+        offsets.append(OFFSET.pack(offset))
+        record = RECORD.pack(ttl, hits, len(name), len(ip)) + name + ip
+        body.append(record)
+        offset += len(record)
+
+    tmp_file = file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(records), now))
+        f.write(b''.join(offsets))
+        f.write(b''.join(body))
+    os.replace(tmp_file, file)
+
+
+class Snapshot:
+
+    def __init__(self, buffer, count, saved_at):
+        self.buffer = buffer
+        self.count = count
+        self.saved_at = saved_at
+
+    @classmethod
+    def open(cls, file):
+        """Return None if there is no usable snapshot."""
+        try:
+            with open(file, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            '''No such file, or the file is empty.'''
+            return None
+
+        if len(buffer) < HEADER.size:
+            return None
+        magic, version, count, saved_at = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            return None
+        return cls(buffer, count, saved_at)
+
+    def read_record(self, index):
+        offset = OFFSET.unpack_from(self.buffer, HEADER.size + OFFSET.size * index)[0]
+        ttl, hits, name_len, ip_len = RECORD.unpack_from(self.buffer, offset)
+        start = offset + RECORD.size
+        name = self.buffer[start:start + name_len]
+        ip = self.buffer[start + name_len:start + name_len + ip_len]
+        return name, ip, ttl, hits
+
+    def make_entry(self, ip, ttl, hits, now):
+        expire = self.saved_at + ttl
+        if expire <= now:
+            return None
+        return CacheEntry(str(ip, encoding='utf-8'), expire, hits)
+
+    def lookup(self, domain, now=None):
+        """Return a CacheEntry, or None if the domain is not in the snapshot or its TTL has run out."""
+        if now is None:
+            now = time.time()
+
+        name = domain.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record_name, ip, ttl, hits = self.read_record(middle)
+            if record_name < name:
+                low = middle + 1
+            elif record_name > name:
+                high = middle
+            else:
+                return self.make_entry(ip, ttl, hits, now)
+        return None
+
+    def entries(self, now=None):
+        """Iterate (domain, CacheEntry) over all records which have not expired."""
+        if now is None:
+            now = time.time()
+
+        for index in range(self.count):
+            name, ip, ttl, hits = self.read_record(index)
+            entry = self.make_entry(ip, ttl, hits, now)
+            if entry is not None:
+                yield str(name, encoding='utf-8'), entry
@@ -0,0 +1,109 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: stress_cache.py
+# description:
+#   1. Stress test of DNSCache (cache.py). Many threads read and write the cache at the same time while another thread
+       keeps iterating it (entries) and writing snapshots (save), like the connection threads and the snapshot thread
+       of the local server do.
+#   2. Every domain always maps to the same IP address, so any wrong answer, lost key or exception is a failure. The
+       script exits with code 1 on failure.
+#   3. At the end it prints the throughput (operations per second) of the cache.
+#   4. Usage: python stress_cache.py [n_threads] [n_operations_per_thread]
+"""
+
+
+import os
+import sys
+import time
+import random
+import tempfile
+import threading
+
+from cache import DNSCache
+
+
+N_KEYS = 5000
+
+
+def domain_of(key):
+    return 'host{0}.stress.com'.format(key)
+
+
+def ip_of(key):
+    return '10.{0}.{1}.{2}'.format(key >> 16 & 255, key >> 8 & 255, key & 255)
+
+
+def worker(cache, n_operations, seed, errors, counter):
+    rand = random.Random(seed)
+    try:
+        for _ in range(n_operations):
+            key = rand.randrange(N_KEYS)
+            if rand.random() < 0.2:
+                cache[domain_of(key)] = ip_of(key)
+            else:
+                ip = cache.get(domain_of(key))
+                if ip != '' and ip != ip_of(key):
+                    errors.append('wrong answer for {0}: {1}'.format(domain_of(key), ip))
+                    return
+    except Exception as e:
+        errors.append(repr(e))
+    counter.append(n_operations)
+
+
+def iterator(cache, snapshot_file, stop, errors):
+    try:
+        while not stop.is_set():
+            for domain, entry in cache.entries().items():
+                if entry.ip != ip_of(int(domain[4:].split('.')[0])):
+                    errors.append('wrong entry for {0}: {1}'.format(domain, entry.ip))
+                    return
+            cache.save(snapshot_file)
+    except Exception as e:
+        errors.append(repr(e))
+
+
+def main(n_threads=16, n_operations=50000):
+    snapshot_file = os.path.join(tempfile.mkdtemp(), 'stress.snap')
+    cache = DNSCache(ttl=3600)
+    errors = []
+    counter = []
+    stop = threading.Event()
+
+    iterator_thread = threading.Thread(target=iterator, args=(cache, snapshot_file, stop, errors))
+    iterator_thread.start()
+
+    threads = [threading.Thread(target=worker, args=(cache, n_operations, seed, errors, counter))
+               for seed in range(n_threads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    stop.set()
+    iterator_thread.join()
+
+    '''Every key written must still be there with the right value, in memory and in the last snapshot.'''
+    for key in range(N_KEYS):
+        if cache.get(domain_of(key)) not in ('', ip_of(key)):
+            errors.append('wrong final value for {0}'.format(domain_of(key)))
+    cache.save(snapshot_file)
+    reloaded = DNSCache.load(snapshot_file, '', 3600)
+    for domain, entry in cache.entries().items():
+        if reloaded.get(domain) != entry.ip:
+            errors.append('lost in snapshot: {0}'.format(domain))
+
+    print('threads: {0}, operations: {1}, time: {2:.2f}s, {3:.0f} ops/s, keys: {4}'.format(
+        n_threads, sum(counter), elapsed, sum(counter) / elapsed, len(cache)))
+    if errors:
+        print('FAILED: {0} errors, first: {1}'.format(len(errors), errors[0]))
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -0,0 +1,88 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: zone_transfer.py
+# description:
+#   1. Bulk zone transfer into the cache of DNSDefaultServer. Instead of learning the names of a zone one miss at a
+       time, the local server asks the TLS server of the zone for all of them at once: "ZONE_TRANSFER_ASK [prefix]"
+       on the query port. The TLS server streams "ZONE_TRANSFER_BEGIN {serial}", one "name ip" line per name and
+       "ZONE_TRANSFER_END {serial} {count}" over the same connection, and the names are put into the cache as the
+       chunks arrive, so a large zone never has to fit in one buffer.
+#   2. The zones to preload are listed in a zone file (zones.dat), one "tld ip port [prefix]" per line, where ip port
+       is the TLS server of the zone. A prefix only loads the names starting with it.
+#   3. A transfer which does not end with the END line (the connection broke) raises ValueError; the names which
+       arrived before are kept.
+#   4. Run this file to time a transfer without a local server:
+       python zone_transfer.py com 127.0.0.1:5678 [--prefix {prefix}]
+"""
+
+
+import sys
+import time
+import socket
+import argparse
+
+
+def read_zone_file(file):
+    """Return [(tld, (ip, port), prefix), ] from lines of "tld ip port [prefix]"."""
+    zones = []
+    with open(file) as f:
+        data = f.readlines()
+    for line in data:
+        line_list = line.strip().split()
+        if len(line_list) in (3, 4):
+            prefix = line_list[3].lower() if len(line_list) == 4 else ''
+            zones.append((line_list[0].lower(), (line_list[1], int(line_list[2])), prefix))
+    return zones
+
+
+def transfer_zone(address, prefix, store, msg_size=64 * 1024, timeout=30):
+    """Call store(name, ip) for every record of the zone transfer from address. Return (serial, count)."""
+    connection = socket.create_connection(address, timeout=timeout)
+    try:
+        connection.sendall(bytes('ZONE_TRANSFER_ASK {0}'.format(prefix).strip(), encoding='utf-8'))
+        serial = None
+        count = 0
+        rest = b''
+        while True:
+            chunk = connection.recv(msg_size)
+            if chunk == b'':
+                break
+            lines = (rest + chunk).split(b'\n')
+            '''The last piece is an incomplete line (or b'' after a newline), it is finished by the next chunk.'''
+            rest = lines.pop()
+            for line in lines:
+                fields = str(line, encoding='utf-8').split()
+                if len(fields) == 2 and fields[0] == 'ZONE_TRANSFER_BEGIN':
+                    serial = int(fields[1])
+                elif len(fields) == 3 and fields[0] == 'ZONE_TRANSFER_END':
+                    if int(fields[2]) != count:
+                        raise ValueError('Zone transfer lost records: {0} of {1}'.format(count, fields[2]))
+                    return int(fields[1]), count
+                elif len(fields) == 2 and serial is not None:
+                    store(fields[0], fields[1])
+                    count += 1
+    finally:
+        connection.close()
+    raise ValueError('Zone transfer ended early after {0} records'.format(count))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Time a zone transfer from a TLS server.')
+    parser.add_argument('tld')
+    parser.add_argument('server', help='TLS server of the zone, e.g. 127.0.0.1:5678')
+    parser.add_argument('--prefix', default='')
+    args = parser.parse_args(argv)
+
+    host, port = args.server.rsplit(':', 1)
+    records = {}
+    start = time.perf_counter()
+    serial, count = transfer_zone((host, int(port)), args.prefix, records.__setitem__)
+    elapsed = time.perf_counter() - start
+    print('{0}: {1} records, serial {2}, {3:.3f} s'.format(args.tld, count, serial, elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
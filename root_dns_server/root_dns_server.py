@@ -17,32 +17,53 @@
     - 4.2. If the method is iterative (I), root DNS server will send next query address back to default local sever.
 #    5. If any of the server that root DNS requests break down or loss connection or time out, the root DNS server will
        send <0xFF, {id}, "Host not found"> back to default local DNS server.
+#    6. A query may carry a trace ID as 4th field: <id, domain, method, trace_id>. Then the root DNS server writes its span
+       timings to ./log/{id}.trace (dns_common/trace.py) and passes the trace ID on to the TLS server.
+#    7. Every answered query is written to the structured query log ./log/{id}.qlog (dns_common/querylog.py).
+#    8. Options: --id, --port and --reuse-port (several worker processes on one port, see supervisor/supervisor.py).
 """
 
 
+import os
+import sys
 import time
 import socket
+import argparse
 import threading
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common.trace import Tracer
+from dns_common.querylog import QueryLog
+from dns_common import codec
+
 
 class DNSRootServer:
 
-    def __init__(self, id_, port_, server_file):
+    def __init__(self, id_, port_, server_file, backlog=128, reuse_port=False):
         address_ = ('127.0.0.1', port_)
 
         self.id = id_
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server_socket.bind(address_)
-        self.server_socket.listen(5)
+        self.server_socket.listen(backlog)
 
         self.msg_size = 64 * 1024
+        self.encoder = codec.MessageEncoder(self.id)
 
         self.dns_server_dict = self.build_default_server_dict(server_file)
         # self.dns_server_dict = {'com': ('127.0.0.1', 5678),
         #                         'org': ('127.0.0.1', 5679),
         #                         'gov': ('127.0.0.1', 5680),
         #                         }
+        '''referral_dict: the iterative answer for every top level domain never changes, so it is encoded once.'''
+        self.referral_dict = {tld: self.encoder.referral(ip, port) for tld, (ip, port) in self.dns_server_dict.items()}
+
         self.log_dir = './log/{0}.log'.format(self.id)
+        self.tracer = Tracer(self.id, './log/{0}.trace'.format(self.id))
+        self.query_log = QueryLog('./log/{0}.qlog'.format(self.id))
 
     @staticmethod
     def build_default_server_dict(file):
@@ -62,117 +83,111 @@ class DNSRootServer:
         return self.server_socket.accept()
 
     def recv_query(self, connection_):
+        """Return the received bytes, b'' if the connection is lost."""
         try:
             data = connection_.recv(self.msg_size)
         except ConnectionResetError:
             connection_.close()
-            return ''
+            return b''
+
+        self.write_log(codec.log_line(data))
+        return data
 
-        query_ = str(data, encoding='utf-8')
+    def send_response(self, connection, address, send_msg):
+        connection.sendto(send_msg, address)
 
-        self.write_log(query_[1:-1] + '\n')
-        return query_
+        self.write_log(codec.log_line(send_msg))
 
-    def resolve_query(self, query, connection, address):
-        query_list = query[1:-1].split(',')
-        if len(query_list) != 3:
-            send_msg = "<0xEE, {0}, {1}>".format(self.id, "Invalid format")
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+    def resolve_query(self, query, connection, address, arrived=None):
+        if arrived is None:
+            arrived = time.time()
 
-            self.write_log(send_msg[1:-1] + '\n')
+        parsed = codec.parse_query(query)
+        if parsed is None or (parsed[2] != 'R' and parsed[2] != 'I'):
+            self.send_response(connection, address, self.encoder.invalid())
             return None
-        domain = query_list[1].strip()
-        method = query_list[2].strip()
+        client, domain, method, trace_id = parsed
 
-        if method != 'R' and method != 'I':
-            send_msg = "<0xEE, {0}, {1}>".format(self.id, "Invalid format")
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+        span = self.tracer.span(trace_id, domain, arrived)
+        span.start()
+        code = self.resolve_domain(query, domain, method, connection, address, span)
+        span.finish(code)
+        self.query_log.write(client, domain, method, code, time.time() - arrived, None, arrived)
 
-            self.write_log(send_msg[1:-1] + '\n')
-            return None
+    def send_not_found(self, connection, address):
+        self.send_response(connection, address, self.encoder.not_found())
+        return codec.CODE_NOT_FOUND
 
+    def resolve_domain(self, query, domain, method, connection, address, span):
+        """Return the response code sent to the local server."""
         '''recursively or iteratively ask next level DNS'''
         top_level_domain = domain.split('.')[-1]
         next_address = self.dns_server_dict.get(top_level_domain, '')
         if next_address == '':
-            send_msg = "<0xFF, {0}, {1}>".format(self.id, "Host not found")
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
-
-            self.write_log(send_msg[1:-1] + '\n')
-            return None
+            return self.send_not_found(connection, address)
 
         if method == 'R':
-            '''Query on behalf of user.'''
+            '''Query on behalf of user. The query is passed on as it is, with the trace ID if there is one.'''
+            span.upstream_begin()
             try:
                 client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 client_socket.settimeout(3)
-                client_socket.connect(next_address)
-                # print(next_address)
-                client_socket.sendall(bytes(query, encoding="utf-8"))
-                ret_bytes = client_socket.recv(self.msg_size)
-                # client_socket.close()
-                response_msg = str(ret_bytes, encoding="utf-8")
-                self.write_log(response_msg[1:-1] + '\n')
-
-            except ConnectionResetError:
-                send_msg = "<0xFF, {0}, {1}>".format(self.id, "Host not found")
-                connection.sendto(bytes(send_msg, encoding="utf-8"), address)
-
-                self.write_log(send_msg[1:-1] + '\n')
-                return None
-
-            except ConnectionRefusedError:
-                send_msg = "<0xFF, {0}, {1}>".format(self.id, "Host not found")
-                connection.sendto(bytes(send_msg, encoding="utf-8"), address)
-
-                self.write_log(send_msg[1:-1] + '\n')
-                return None
-
-            except socket.timeout:
-                send_msg = "<0xFF, {0}, {1}>".format(self.id, "Host not found")
-                connection.sendto(bytes(send_msg, encoding="utf-8"), address)
-
-                self.write_log(send_msg[1:-1] + '\n')
-                return None
-
-            response_msg_from_next = response_msg
-            response_msg_from_next_list = response_msg_from_next[1:-1].split(',')
-            code = response_msg_from_next_list[0].strip()
-            ip = response_msg_from_next_list[2].strip()
-
-            # if code == '0x00':
-            #     ip = response_msg_from_next_list[2].strip()
-            #     self.dns_cache[domain] = ip
-
-            send_msg = "<{0}, {1}, {2}>".format(code, self.id, ip)
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
-
-            self.write_log(send_msg[1:-1] + '\n')
-
-        elif method == "I":
+                try:
+                    client_socket.connect(next_address)
+                    client_socket.sendall(query)
+                    response_msg = client_socket.recv(self.msg_size)
+                finally:
+                    client_socket.close()
+                self.write_log(codec.log_line(response_msg))
+
+            except (ConnectionResetError, ConnectionRefusedError, socket.timeout):
+                return self.send_not_found(connection, address)
+
+            finally:
+                span.upstream_end()
+
+            response_list = codec.parse_response(response_msg)
+            if response_list is None:
+                return self.send_not_found(connection, address)
+
+            code = response_list[0]
+            '''An answer through aliases (0x00 or 0x02) carries the alias chain as 4th field.'''
+            chain = codec.parse_chain(response_list[3]) if len(response_list) == 4 else None
+            self.send_response(connection, address, self.encoder.response(code, response_list[2], chain))
+            return code
+
+        else:
             '''Return next TLS server address.'''
-            send_msg = "<0x01, {0}, {1}, {2}>".format(self.id, next_address[0], next_address[1])
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
-
-            self.write_log(send_msg[1:-1] + '\n')
+            self.send_response(connection, address, self.referral_dict[top_level_domain])
+            return codec.CODE_REFERRAL
 
 
 def process_connection(server, connection, address):
     while True:
         query = server.recv_query(connection)
-        if query == '':
+        arrived = time.time()
+        if query == b'':
             print('Loss connection: {0}, {1}'.format(address[0], address[1]))
             break
 
-        server.resolve_query(query, connection, address)
+        server.resolve_query(query, connection, address, arrived)
         server.write_log('\n')
         time.sleep(3)
         connection.close()
         break
 
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='DNS root server.')
+    parser.add_argument('--id', default='Root_DNS_Server')
+    parser.add_argument('--port', type=int, default=5353)
+    parser.add_argument('--reuse-port', action='store_true', help='share the port with other root server workers')
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
-    root_server = DNSRootServer("Root_DNS_Server", 5353, './data/server.dat')
+    args = parse_args(sys.argv[1:])
+    root_server = DNSRootServer(args.id, args.port, './data/server.dat', reuse_port=args.reuse_port)
     print("server start!")
 
     while True:
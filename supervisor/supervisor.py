@@ -0,0 +1,298 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: supervisor.py
+# description:
+#   1. One command starts the whole hierarchy: python supervisor.py [./data/topology.dat]
+       The topology file has one line per tier, started in the order of the file (TLS servers, root, local):
+       name script id port workers cpus [options ...]
+       script is relative to the repository and is run in its own directory, so its ./data and ./log paths work.
+       Worker i (from 1) of a tier runs "script --id {id}_{i} --port {port} --reuse-port [options]": all workers of a
+       tier listen on the same port and the kernel spreads the connections and datagrams over them.
+#   2. cpus is "-" (no pinning) or a list like "0,1" or "2-5": worker i is pinned to the i-th CPU of the list (round
+       robin). The option "+followers" gives every worker after the first --follower (TLS servers: only the first
+       worker takes zone updates, the others apply them from the journal).
+#   3. A tier is ready when every worker has printed "server start!" (after its listeners are bound); the next tier is
+       started only then. When all tiers are ready the supervisor prints a readiness report.
+#   4. A worker which exits is restarted, after 1 second, doubled up to 30 seconds while it keeps crashing within 10
+       seconds of its start. The output of worker i of a tier goes to ./log/{name}_{i}.out.
+#   5. Scaling: change the workers of a tier in the topology file and send SIGHUP; workers are started or stopped to
+       match. A stopped worker is waited for (and killed after stop_timeout seconds) while the others keep running.
+       SIGINT or SIGTERM stops the tiers in reverse order with SIGTERM (the local servers drain) and kills the workers
+       still running after stop_timeout seconds, also those still stopping from a scale down.
+"""
+
+
+import os
+import sys
+import time
+import signal
+import argparse
+import threading
+import subprocess
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+READY_LINE = 'server start!'
+
+
+def parse_cpus(field):
+    """Return the CPU list of a cpus field: "-", "0,1" or "2-5"."""
+    if field == '-':
+        return []
+    cpus = []
+    for part in field.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def read_topology_file(file):
+    """Return [Tier, ] from lines of "name script id port workers cpus [options ...]", # starts a comment."""
+    tiers = []
+    with open(file) as f:
+        data = f.readlines()
+    for line in data:
+        line_list = line.split('#')[0].strip().split()
+        if len(line_list) >= 6:
+            name, script, id_, port, workers, cpus = line_list[:6]
+            tiers.append(Tier(name, script, id_, int(port), int(workers), parse_cpus(cpus), line_list[6:]))
+    return tiers
+
+
+class Tier:
+
+    def __init__(self, name, script, id_, port, workers, cpus, options):
+        self.name = name
+        self.script = script
+        self.id = id_
+        self.port = port
+        self.workers = workers
+        self.cpus = cpus
+        self.followers = '+followers' in options
+        self.options = [option for option in options if option != '+followers']
+
+    def worker_args(self, index):
+        args = ['--id', '{0}_{1}'.format(self.id, index), '--port', str(self.port), '--reuse-port'] + self.options
+        if self.followers and index > 1:
+            args.append('--follower')
+        return args
+
+    def worker_cpu(self, index):
+        return self.cpus[(index - 1) % len(self.cpus)] if self.cpus else None
+
+
+class Worker:
+
+    def __init__(self, tier, index, log_dir):
+        self.tier = tier
+        self.index = index
+        self.name = '{0}#{1}'.format(tier.name, index)
+        self.out_file = os.path.join(log_dir, '{0}_{1}.out'.format(tier.name, index))
+
+        self.process = None
+        self.ready = threading.Event()
+        self.started = 0
+        self.restarts = 0
+        self.backoff = 1.0
+        self.restart_at = None
+
+    def start(self):
+        script = os.path.join(ROOT_DIR, self.tier.script)
+        self.ready.clear()
+        self.started = time.time()
+        self.restart_at = None
+        self.process = subprocess.Popen([sys.executable, '-u', script] + self.tier.worker_args(self.index),
+                                        cwd=os.path.dirname(script), stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        cpu = self.tier.worker_cpu(self.index)
+        if cpu is not None:
+            try:
+                os.sched_setaffinity(self.process.pid, {cpu})
+            except (AttributeError, OSError) as e:
+                print('{0}: cannot pin to CPU {1}: {2}'.format(self.name, cpu, e))
+
+        output_thread = threading.Thread(target=self.copy_output, args=(self.process,))
+        output_thread.daemon = True
+        output_thread.start()
+
+    def copy_output(self, process):
+        with open(self.out_file, 'a', encoding='utf-8') as f:
+            for line in process.stdout:
+                line = str(line, encoding='utf-8', errors='replace')
+                f.write(line)
+                f.flush()
+                if READY_LINE in line and process is self.process:
+                    self.ready.set()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def schedule_restart(self, now):
+        '''A worker which crashes soon after its start waits twice as long each time.'''
+        if now - self.started < 10:
+            self.backoff = min(self.backoff * 2, 30.0)
+        else:
+            self.backoff = 1.0
+        self.restart_at = now + self.backoff
+
+    def stop(self):
+        if self.alive():
+            self.process.send_signal(signal.SIGTERM)
+
+
+class Supervisor:
+
+    def __init__(self, topology_file, log_dir='./log', ready_timeout=30.0, stop_timeout=10.0):
+        self.topology_file = topology_file
+        self.log_dir = log_dir
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+
+        self.tiers = read_topology_file(topology_file)
+        '''workers: formatted as {tier name: [Worker, ]}, worker i of a tier at index i - 1'''
+        self.workers = {}
+        '''retired: [(Worker, kill time), ] removed by a scale down and not reaped yet'''
+        self.retired = []
+        self.stopping = False
+        self.reload = False
+
+    def start(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        start = time.time()
+        for tier in self.tiers:
+            self.workers[tier.name] = []
+            self.scale(tier)
+            if not self.wait_ready(tier):
+                print('Tier {0} is not ready after {1} seconds.'.format(tier.name, self.ready_timeout))
+                return False
+        print(self.readiness_report(time.time() - start))
+        return True
+
+    def scale(self, tier):
+        workers = self.workers[tier.name]
+        while len(workers) < tier.workers:
+            worker = Worker(tier, len(workers) + 1, self.log_dir)
+            worker.start()
+            workers.append(worker)
+            print('start {0}: pid {1}'.format(worker.name, worker.process.pid))
+        while len(workers) > tier.workers:
+            worker = workers.pop()
+            worker.stop()
+            self.retired.append((worker, time.time() + self.stop_timeout))
+            print('stop {0}: pid {1}'.format(worker.name, worker.process.pid))
+
+    def reap_retired(self, now):
+        '''poll() reaps a worker which has exited; one which is still running after stop_timeout is killed.'''
+        retired = []
+        for worker, kill_at in self.retired:
+            if worker.alive() and now >= kill_at:
+                worker.process.kill()
+                worker.process.wait()
+                print('killed {0}: pid {1}'.format(worker.name, worker.process.pid))
+            elif worker.alive():
+                retired.append((worker, kill_at))
+            else:
+                print('{0} stopped with code {1}'.format(worker.name, worker.process.returncode))
+        self.retired = retired
+
+    def wait_ready(self, tier):
+        deadline = time.time() + self.ready_timeout
+        for worker in self.workers[tier.name]:
+            while not worker.ready.wait(0.1):
+                if time.time() > deadline or not worker.alive() or self.stopping:
+                    return False
+        return True
+
+    def readiness_report(self, elapsed):
+        lines = ['ready in {0:.2f} s:'.format(elapsed)]
+        for tier in self.tiers:
+            workers = self.workers.get(tier.name, [])
+            lines.append('  {0:<8} port {1:<5} {2}/{3} workers ready  pids {4}'.format(
+                tier.name, tier.port, sum(1 for worker in workers if worker.ready.is_set()), tier.workers,
+                ' '.join(str(worker.process.pid) for worker in workers)))
+        return '\n'.join(lines)
+
+    def reload_topology(self):
+        '''SIGHUP: start or stop workers to match the worker counts of the topology file.'''
+        for new_tier in read_topology_file(self.topology_file):
+            for tier in self.tiers:
+                if tier.name == new_tier.name and tier.workers != new_tier.workers:
+                    print('scale {0}: {1} -> {2} workers'.format(tier.name, tier.workers, new_tier.workers))
+                    tier.workers = new_tier.workers
+                    self.scale(tier)
+
+    def monitor(self, interval=0.5):
+        while not self.stopping:
+            if self.reload:
+                self.reload = False
+                self.reload_topology()
+            now = time.time()
+            self.reap_retired(now)
+            for tier in self.tiers:
+                for worker in self.workers[tier.name]:
+                    if worker.alive():
+                        continue
+                    if worker.restart_at is None:
+                        worker.schedule_restart(now)
+                        print('{0} exited with code {1}, restart in {2:.0f} s'.format(
+                            worker.name, worker.process.returncode, worker.backoff))
+                    elif now >= worker.restart_at:
+                        worker.restarts += 1
+                        worker.start()
+                        print('restart {0}: pid {1} (restart {2})'.format(
+                            worker.name, worker.process.pid, worker.restarts))
+            time.sleep(interval)
+
+    def stop(self):
+        self.stopping = True
+        for tier in reversed(self.tiers):
+            workers = self.workers.get(tier.name, [])
+            for worker in workers:
+                worker.stop()
+            '''Workers of a scale down have had their SIGTERM already; they are waited for with the others.'''
+            workers = workers + [worker for worker, kill_at in self.retired if worker.tier is tier]
+            deadline = time.time() + self.stop_timeout
+            for worker in workers:
+                if worker.process is None:
+                    continue
+                try:
+                    worker.process.wait(max(deadline - time.time(), 0))
+                except subprocess.TimeoutExpired:
+                    worker.process.kill()
+                    worker.process.wait()
+            print('stopped {0}'.format(tier.name))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Start and watch all tiers of the DNS hierarchy.')
+    parser.add_argument('topology', nargs='?', default='./data/topology.dat')
+    parser.add_argument('--ready-timeout', type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    supervisor = Supervisor(args.topology, ready_timeout=args.ready_timeout)
+
+    def request_stop(signum, frame):
+        supervisor.stopping = True
+
+    def request_reload(signum, frame):
+        supervisor.reload = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGHUP, request_reload)
+
+    try:
+        if supervisor.start():
+            supervisor.monitor()
+    finally:
+        supervisor.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -12,36 +12,129 @@
 #   4. For resolve query, no matter what the method is, it will check database and give a response to the sender.
 #   5.  When connection between TSL server and any senders ends abnormally, it will print "Loss connection
     {ip_address}, {port}".
+#   6. A query may carry a trace ID as 4th field: <id, domain, method, trace_id>. Then the server writes its span timings
+    to ./log/{id}.trace (dns_common/trace.py).
+#   7. Every answered query is written to the structured query log ./log/{id}.qlog (dns_common/querylog.py).
+#   8. Alias records: a database line "alias CNAME name" makes alias another name for name. The server follows the
+    chain of aliases itself and sends the address and the whole chain back in one response:
+    <0x00, {id}, ip, alias ... name>. If the chain goes on in another zone, it sends <0x02, {id}, target, alias ...
+    target> and the local server asks for target. A chain which comes back to a name it has passed (loop) or which is
+    longer than max_alias_depth is answered with <0xFF, {id}, "Alias loop"> or <0xFF, {id}, "Alias chain too long">.
+#   9. Incremental zone updates (zone_update.py): with update_file, the server listens on the update port of its line
+    in update.dat for signed batches of add/delete/replace operations with serial numbers. A batch is checked, appended
+    to the journal and applied at once, so a query sees all of a batch or none of it. The journal is replayed on start.
+#   10. Every batch raises the serial of the zone. A local server asks "ZONE_CHANGES_ASK {its serial}" on the query port
+    and gets back "ZONE_CHANGES_ACK {serial} {full} name name ...": the names changed since its serial (with the
+    aliases leading to them), so it can drop them from its cache. full is 1 when the changes are too old or too many
+    to list; then the whole zone should be dropped.
+#   11. Zone transfer: "ZONE_TRANSFER_ASK [prefix]" on the query port streams every name of the zone (or every name
+    starting with prefix, "www." not counted) with its address over the same connection, in chunks of transfer_chunk
+    lines: "ZONE_TRANSFER_BEGIN {serial}", then "name ip" per line, then "ZONE_TRANSFER_END {serial} {count}".
+    Aliases are sent with the address at the end of their chain; aliases which leave the zone are left out. The
+    names are collected under the zone lock, so a transfer is one consistent version of the zone.
+#   12. Several worker processes can serve one zone on one port (reuse_port, started by supervisor/supervisor.py). The
+    first worker takes the updates and writes the journal; the others (--follower) read the journal every second and
+    apply the new batches, so all workers serve the same serial within a second.
+#   13. The addresses of the zone are kept in a compact RecordTable (dns_common/records.py) instead of a dict of str,
+    about 42 instead of 160 bytes per record. Addresses are validated on load: a line with a malformed address (e.g.
+    78.46.893.288) is skipped with a warning, and an update with one is refused.
 """
 
+import os
+import sys
+import json
+import hmac
+import time
 import socket
+import argparse
+import threading
+import collections
+
+from zone_update import read_update_file, sign_batch, parse_ops, check_ops, apply_ops, affected_names, Journal
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common.trace import Tracer
+from dns_common.querylog import QueryLog
+from dns_common import codec
+from dns_common.records import RecordTable
+
+
+def bare_name(domain):
+    '''www.x and x are the same name.'''
+    return domain[4:] if domain.startswith('www.') else domain
+
+
+def parse_args(argv, id_, port_):
+    """Command line of the tls_*.py scripts, id_ and port_ are the defaults of the zone."""
+    parser = argparse.ArgumentParser(description='DNS TLS server of one zone.')
+    parser.add_argument('--id', default=id_)
+    parser.add_argument('--port', type=int, default=port_)
+    parser.add_argument('--reuse-port', action='store_true', help='share the port with other workers of the zone')
+    parser.add_argument('--follower', action='store_true', help='apply the updates of another worker from the journal')
+    return parser.parse_args(argv)
 
 
 class DNSTLSServer:
 
-    def __init__(self, id_, port_, default_file):
+    def __init__(self, id_, port_, default_file, backlog=128, max_alias_depth=8, update_file=None,
+                 change_log_size=1024, max_changed_names=2000, transfer_chunk=1000, update_id=None, reuse_port=False):
         address = ('127.0.0.1', port_)
 
         self.id = id_
         self.sk = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sk.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            '''Worker processes of one zone share the port, the kernel spreads the connections.'''
+            self.sk.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sk.bind(address)
-        self.sk.listen(5)
+        self.sk.listen(backlog)
 
         self.msg_size = 64 * 1024
+        self.encoder = codec.MessageEncoder(self.id)
+
+        '''dns_database: RecordTable {domain: ip}, dns_aliases: formatted as {alias: name}'''
+        self.dns_database, self.dns_aliases = self.build_database(default_file)
+        self.max_alias_depth = max_alias_depth
+
+        '''zone_lock makes a batch atomic for queries. change_log: formatted as deque([(serial, names)])'''
+        self.zone_lock = threading.Lock()
+        self.serial = 0
+        self.change_log = collections.deque(maxlen=change_log_size)
+        self.max_changed_names = max_changed_names
+        self.transfer_chunk = transfer_chunk
+        self.journal = Journal(default_file + '.journal')
+        self.replay_journal()
 
-        self.dns_database = self.build_database(default_file)
+        self.update_key = None
+        self.update_socket = None
+        channel = read_update_file(update_file, update_id or self.id)
+        if channel is not None:
+            update_port, self.update_key = channel
+            self.update_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.update_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.update_socket.bind(('127.0.0.1', update_port))
+            self.update_socket.listen(backlog)
 
         self.log_dir = './log/{0}.log'.format(self.id)
+        self.tracer = Tracer(self.id, './log/{0}.trace'.format(self.id))
+        self.query_log = QueryLog('./log/{0}.qlog'.format(self.id))
 
     @staticmethod
     def build_database(file):
-        cache = {}
+        """Return (RecordTable {domain: ip}, {alias: name}) from lines "domain ip" and "alias CNAME name"."""
+        cache = RecordTable()
+        aliases = {}
         with open(file) as f:
-            data = f.readlines()
-        for line in data:
-            line_list = line.strip().split()
-            cache[line_list[0].lower()] = line_list[1]
-        return cache
+            for line_number, line in enumerate(f, 1):
+                line_list = line.strip().split()
+                if len(line_list) == 3 and line_list[1].upper() == 'CNAME':
+                    aliases[line_list[0].lower()] = line_list[2].lower()
+                elif len(line_list) == 2:
+                    try:
+                        cache[line_list[0].lower()] = line_list[1]
+                    except ValueError as e:
+                        print('{0} line {1} skipped: {2}'.format(file, line_number, e))
+        return cache, aliases
 
     def accept(self):
         return self.sk.accept()
@@ -51,18 +144,26 @@ class DNSTLSServer:
             f.write(msg)
 
     def recv_query(self, connection_):
+        """Return the received bytes, b'' if the connection is lost."""
         try:
             data = connection_.recv(self.msg_size)
         except ConnectionResetError:
             connection_.close()
-            return ''
+            return b''
 
-        query_ = str(data, encoding='utf-8')
+        if not data.startswith(b'ZONE_'):
+            '''Zone polls and transfers of the local servers are control messages: they are not logged.'''
+            self.write_log(codec.log_line(data))
+        return data
 
-        self.write_log(query_[1:-1] + '\n')
-        return query_
+    def send_response(self, connection, address, send_msg):
+        connection.sendto(send_msg, address)
 
-    def cache_query(self, domain):
+        self.write_log(codec.log_line(send_msg))
+
+    def cache_query(self, domain, table=None):
+        if table is None:
+            table = self.dns_database
         domain_list = domain.split('.')
         if domain_list[0] != 'www':
             q1 = '.'.join(['www'] + domain_list)
@@ -70,41 +171,236 @@ class DNSTLSServer:
         else:
             q1 = domain
             q2 = '.'.join(domain_list[1:])
-        result1 = self.dns_database.get(q1, '')
-        result2 = self.dns_database.get(q2, '')
+        result1 = table.get(q1, '')
+        result2 = table.get(q2, '')
         if result1 == '':
             return result2
         else:
             return result1
 
-    def resolve_query(self, query, connection, address):
-        query_list = query[1:-1].split(',')
-        if len(query_list) != 3:
-            send_msg = "<0xEE, {0}, {1}>".format(self.id, "Invalid format")
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+    def resolve_alias(self, domain):
+        """Follow the aliases from domain. Return (code, ip, target or reason, chain of names from domain)."""
+        chain = [domain]
+        seen = {bare_name(domain)}
+        name = domain
+        while True:
+            result = self.cache_query(name)
+            if result != '':
+                return codec.CODE_OK, result, None, chain
 
-            self.write_log(send_msg[1:-1] + '\n')
-            return None
-        domain = query_list[1].strip()
-        method = query_list[2].strip()
+            target = self.cache_query(name, self.dns_aliases)
+            if target == '':
+                return codec.CODE_NOT_FOUND, None, codec.NOT_FOUND, chain
+            if bare_name(target) in seen:
+                return codec.CODE_NOT_FOUND, None, codec.ALIAS_LOOP, chain
+            if len(chain) > self.max_alias_depth:
+                '''chain holds domain and one name per alias followed.'''
+                return codec.CODE_NOT_FOUND, None, codec.ALIAS_TOO_DEEP, chain
+
+            chain.append(target)
+            seen.add(bare_name(target))
+            if target.split('.')[-1] != domain.split('.')[-1]:
+                '''The chain leaves this zone: the local server goes on with target.'''
+                return codec.CODE_ALIAS, None, target, chain
+            name = target
+
+    def replay_journal(self):
+        """Apply the batches of the journal after the current serial. Return the number of batches applied."""
+        applied = 0
+        with self.zone_lock:
+            try:
+                for serial, raw_ops in self.journal.read():
+                    if serial <= self.serial:
+                        continue
+                    ops = parse_ops(raw_ops)
+                    if serial != self.serial + 1 or \
+                            check_ops(self.dns_database, self.dns_aliases, ops) is not None:
+                        print('Journal replay stopped at serial {0}.'.format(serial))
+                        break
+                    apply_ops(self.dns_database, self.dns_aliases, ops)
+                    self.serial = serial
+                    self.change_log.append((serial, sorted(affected_names(self.dns_aliases, [op[1] for op in ops]))))
+                    applied += 1
+            except (ValueError, TypeError) as e:
+                print('Journal replay stopped: {0}'.format(e))
+        return applied
+
+    def start_journal_thread(self, interval=1.0):
+        '''A follower worker: the batches are taken by another worker, this one applies them from the journal.'''
+        journal_thread = threading.Thread(target=self.journal_loop, args=(interval,))
+        journal_thread.daemon = True
+        journal_thread.start()
+
+    def journal_loop(self, interval):
+        size = -1
+        while True:
+            time.sleep(interval)
+            try:
+                new_size = os.path.getsize(self.journal.file)
+            except OSError:
+                continue
+            if new_size != size:
+                size = new_size
+                self.replay_journal()
+
+    def start_update_thread(self):
+        if self.update_socket is not None:
+            update_thread = threading.Thread(target=self.serve_updates)
+            update_thread.daemon = True
+            update_thread.start()
 
-        if method != 'R' and method != 'I':
-            send_msg = "<0xEE, {0}, {1}>".format(self.id, "Invalid format")
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+    def serve_updates(self):
+        '''Updates are rare, so they are applied one at a time on this thread.'''
+        while True:
+            try:
+                connection, address = self.update_socket.accept()
+            except OSError:
+                break
+            try:
+                connection.settimeout(30)
+                data = b''
+                while True:
+                    chunk = connection.recv(self.msg_size)
+                    if chunk == b'':
+                        break
+                    data += chunk
+                try:
+                    code, value = self.apply_update(data)
+                except (ValueError, TypeError, KeyError) as e:
+                    '''A malformed batch is refused; it must never stop this thread.'''
+                    code, value = codec.CODE_INVALID, 'Bad batch'
+                    print('update from {0} failed: {1!r}'.format(address[0], e))
+                connection.sendall(self.encoder.response(code, value))
+                print('update from {0}: {1} {2}'.format(address[0], code, value))
+            except OSError:
+                pass
+            finally:
+                connection.close()
 
-            self.write_log(send_msg[1:-1] + '\n')
+    def apply_update(self, data):
+        """Check, journal and apply one batch. Return (code, serial or reason) of the reply."""
+        try:
+            batch = json.loads(str(data, encoding='utf-8'))
+        except ValueError:
+            return codec.CODE_INVALID, 'Bad batch'
+        if not isinstance(batch, dict):
+            return codec.CODE_INVALID, 'Bad batch'
+        if 'ops' not in batch:
+            '''Ask for the current serial.'''
+            return codec.CODE_OK, str(self.serial)
+
+        serial, raw_ops, mac = batch.get('serial'), batch.get('ops'), batch.get('mac')
+        if not isinstance(mac, str) or not hmac.compare_digest(
+                bytes(mac, encoding='utf-8'), bytes(sign_batch(self.update_key, serial, raw_ops), encoding='utf-8')):
+            return codec.CODE_INVALID, 'Bad signature'
+        try:
+            ops = parse_ops(raw_ops)
+        except ValueError as e:
+            return codec.CODE_INVALID, str(e)
+        except TypeError:
+            return codec.CODE_INVALID, 'Bad operation'
+
+        with self.zone_lock:
+            if serial != self.serial + 1:
+                return codec.CODE_INVALID, 'Bad serial: expected {0}'.format(self.serial + 1)
+            reason = check_ops(self.dns_database, self.dns_aliases, ops)
+            if reason is not None:
+                return codec.CODE_INVALID, reason
+
+            self.journal.append(serial, raw_ops)
+            apply_ops(self.dns_database, self.dns_aliases, ops)
+            self.serial = serial
+            self.change_log.append((serial, sorted(affected_names(self.dns_aliases, [op[1] for op in ops]))))
+        return codec.CODE_OK, str(serial)
+
+    def changes_message(self, query):
+        """Reply of ZONE_CHANGES_ASK {since}: ZONE_CHANGES_ACK {serial} {full} name name ..."""
+        try:
+            since = int(str(query, encoding='utf-8').split()[1])
+        except (IndexError, ValueError):
+            since = -1
+
+        with self.zone_lock:
+            serial = self.serial
+            changes = list(self.change_log)
+        names = set()
+        full = 0
+        if 0 <= since < serial:
+            oldest = changes[0][0] if changes else serial + 1
+            if since + 1 < oldest:
+                full = 1
+            else:
+                for change_serial, change_names in changes:
+                    if change_serial > since:
+                        names.update(change_names)
+                if len(names) > self.max_changed_names:
+                    full = 1
+        elif since > serial:
+            '''The asker saw a serial this server does not have (the journal was lost).'''
+            full = 1
+        if full:
+            names = set()
+        return 'ZONE_CHANGES_ACK {0} {1} {2}'.format(serial, full, ' '.join(sorted(names))).strip()
+
+    def zone_records(self, prefix=''):
+        """Return (serial, [(name, ip), ]) of every name of the zone starting with prefix, aliases resolved."""
+        with self.zone_lock:
+            records = [(name, ip) for name, ip in self.dns_database.items() if bare_name(name).startswith(prefix)]
+            for name in self.dns_aliases:
+                if bare_name(name).startswith(prefix):
+                    code, ip, reason, chain = self.resolve_alias(name)
+                    if code == codec.CODE_OK:
+                        records.append((name, ip))
+            return self.serial, records
+
+    def transfer_zone(self, query, connection):
+        """Stream the records of ZONE_TRANSFER_ASK [prefix] in chunks. Return the number of records sent."""
+        fields = str(query, encoding='utf-8').split()
+        prefix = fields[1].lower() if len(fields) > 1 else ''
+        serial, records = self.zone_records(prefix)
+
+        connection.sendall(bytes('ZONE_TRANSFER_BEGIN {0}\n'.format(serial), encoding='utf-8'))
+        for start in range(0, len(records), self.transfer_chunk):
+            chunk = records[start:start + self.transfer_chunk]
+            connection.sendall(bytes(''.join('{0} {1}\n'.format(name, ip) for name, ip in chunk), encoding='utf-8'))
+        connection.sendall(bytes('ZONE_TRANSFER_END {0} {1}\n'.format(serial, len(records)), encoding='utf-8'))
+        return len(records)
+
+    def resolve_query(self, query, connection, address, arrived=None):
+        if arrived is None:
+            arrived = time.time()
+
+        if query.startswith(b'ZONE_CHANGES_ASK'):
+            connection.sendto(bytes(self.changes_message(query), encoding='utf-8'), address)
+            return None
+        if query.startswith(b'ZONE_TRANSFER_ASK'):
+            try:
+                self.transfer_zone(query, connection)
+            except OSError:
+                pass
             return None
 
-        result = self.cache_query(domain)
+        parsed = codec.parse_query(query)
+        if parsed is None or (parsed[2] != 'R' and parsed[2] != 'I'):
+            self.send_response(connection, address, self.encoder.invalid())
+            return None
+        client, domain, method, trace_id = parsed
 
-        if result != '':
-            send_msg = "<0x00, {0}, {1}>".format(self.id, result)
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+        span = self.tracer.span(trace_id, domain, arrived)
+        span.start()
 
-            self.write_log(send_msg[1:-1] + '\n')
+        with self.zone_lock:
+            code, result, reason, chain = self.resolve_alias(domain)
 
+        if code == codec.CODE_OK:
+            '''The chain is only sent if the answer came through an alias.'''
+            self.send_response(connection, address, self.encoder.answer(result, chain if len(chain) > 1 else None))
+        elif code == codec.CODE_ALIAS:
+            self.send_response(connection, address, self.encoder.alias(reason, chain))
+        elif reason == codec.NOT_FOUND:
+            self.send_response(connection, address, self.encoder.not_found())
         else:
-            send_msg = "<0xFF, {0}, {1}>".format(self.id, "Host not found")
-            connection.sendto(bytes(send_msg, encoding="utf-8"), address)
+            self.send_response(connection, address, self.encoder.response(code, reason))
 
-            self.write_log(send_msg[1:-1] + '\n')
+        span.finish(code)
+        self.query_log.write(client, domain, method, code, time.time() - arrived, None, arrived)
@@ -6,28 +6,40 @@
 # description:
 #   This is an entity of DNSTLSServer class from tls_dns_server.py, which handles .gov domain name query for DNS server.
     The server listen on address (127.0.0.1, 5680). (port: 5680)
+    Options: --id, --port, --reuse-port and --follower for the worker processes of supervisor/supervisor.py.
+    Signed zone updates (zone_update.py) are taken on port 6680, see ./data/update.dat.
 """
 
-import socket
+import sys
+import time
 import threading
 
-from tls_dns_server import DNSTLSServer
+from tls_dns_server import DNSTLSServer, parse_args
 
 
 def process_connection(server, connection):
     while True:
         query = server.recv_query(connection)
-        if query == '':
+        arrived = time.time()
+        if query == b'':
             print('Loss connection: {0}, {1}'.format(address[0], address[1]))
             break
-        server.resolve_query(query, connection, address)
+        server.resolve_query(query, connection, address, arrived)
         connection.close()
 
-        server.write_log('\n')
+        if not query.startswith(b'ZONE_'):
+            server.write_log('\n')
         break
 
 
-gov_server = DNSTLSServer("GOV_DNS_Server", 5680, './data/gov.dat')
+args = parse_args(sys.argv[1:], "GOV_DNS_Server", 5680)
+update_file = None if args.follower else './data/update.dat'
+gov_server = DNSTLSServer(args.id, args.port, './data/gov.dat', update_file=update_file, update_id="GOV_DNS_Server",
+                          reuse_port=args.reuse_port)
+if args.follower:
+    gov_server.start_journal_thread()
+else:
+    gov_server.start_update_thread()
 print("server start!")
 
 while True:
@@ -0,0 +1,207 @@
+# encoding = utf-8
+# author: Wei Dai
+# date: 10/19/2026
+"""
+# file name: zone_update.py
+# description:
+#   1. Incremental zone updates of a running DNSTLSServer. A batch of changes is sent to the update port of the server
+       as one JSON object: {"serial": n, "ops": [operation, ], "mac": signature}. Operations:
+       ["add", name, ip], ["add", name, "CNAME", target], ["delete", name], ["replace", name, ip or "CNAME", target]
+       "add" needs a name which is not in the zone, "delete" and "replace" one which is.
+#   2. The update channel is authenticated by configuration: ./data/update.dat holds one line "server_id port key" per
+       server, and a batch is signed with HMAC-SHA256 of its serial and operations under the key of the server.
+#   3. Serials start at 1 and every batch must carry the serial after the last one, so a batch can never be applied
+       twice or out of order. A batch is checked completely before anything changes; then it is appended to the
+       journal ({zone file}.journal, one JSON line per batch, synced to disk) and applied at once. On start, the server
+       replays the journal over the zone file.
+#   4. An address must be a valid IPv4 or IPv6 address (dns_common/records.py), otherwise the batch is refused.
+#   5. Send a batch from a file with lines "add name ip", "add name CNAME target", "delete name", "replace name ip":
+       python zone_update.py COM_DNS_Server {delta file} [--serial n]
+       Without --serial the current serial is asked from the server first (an empty object {} on the update port).
+"""
+
+
+import os
+import sys
+import hmac
+import json
+import socket
+import hashlib
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dns_common import codec
+from dns_common.records import valid_address
+
+
+def read_update_file(file, server_id):
+    """Return (port, key) of server_id from lines "server_id port key", or None if it has no update channel."""
+    if file is None or not os.path.exists(file):
+        return None
+    with open(file) as f:
+        data = f.readlines()
+    for line in data:
+        line_list = line.strip().split()
+        if len(line_list) == 3 and line_list[0] == server_id:
+            return int(line_list[1]), line_list[2]
+    return None
+
+
+def sign_batch(key, serial, ops):
+    message = json.dumps({'serial': serial, 'ops': ops}, sort_keys=True, separators=(',', ':'))
+    return hmac.new(bytes(key, encoding='utf-8'), bytes(message, encoding='utf-8'), hashlib.sha256).hexdigest()
+
+
+def parse_ops(raw_ops):
+    """Return [(action, name, ip, target), ] with ip or target None. Raise ValueError if an operation is malformed."""
+    ops = []
+    for op in raw_ops:
+        if not isinstance(op, list) or len(op) < 2 or not all(isinstance(field, str) for field in op):
+            raise ValueError('Bad operation')
+        action, name = op[0], op[1].lower()
+        if action == 'delete' and len(op) == 2:
+            ops.append((action, name, None, None))
+        elif action in ('add', 'replace') and len(op) == 3:
+            if not valid_address(op[2]):
+                raise ValueError('Bad address: {0}'.format(op[2]))
+            ops.append((action, name, op[2], None))
+        elif action in ('add', 'replace') and len(op) == 4 and op[2].upper() == 'CNAME':
+            ops.append((action, name, None, op[3].lower()))
+        else:
+            raise ValueError('Bad operation: {0} {1}'.format(op[0], op[1]))
+    return ops
+
+
+def check_ops(database, aliases, ops):
+    """Return None if every operation can be applied in order, otherwise the reason why not."""
+    present = {}
+    for action, name, ip, target in ops:
+        exists = present.get(name, name in database or name in aliases)
+        if action == 'add' and exists:
+            return 'Record exists: {0}'.format(name)
+        if action != 'add' and not exists:
+            return 'No record: {0}'.format(name)
+        present[name] = action != 'delete'
+    return None
+
+
+def apply_ops(database, aliases, ops):
+    for action, name, ip, target in ops:
+        database.pop(name, None)
+        aliases.pop(name, None)
+        if action != 'delete':
+            if target is None:
+                database[name] = ip
+            else:
+                aliases[name] = target
+
+
+def bare_name(domain):
+    return domain[4:] if domain.startswith('www.') else domain
+
+
+def affected_names(aliases, names):
+    """Return the changed names and every alias whose chain leads to one of them."""
+    affected = set(bare_name(name) for name in names)
+    result = set(names)
+    changed = True
+    while changed:
+        changed = False
+        for alias, target in aliases.items():
+            if bare_name(target) in affected and bare_name(alias) not in affected:
+                affected.add(bare_name(alias))
+                result.add(alias)
+                changed = True
+    return result
+
+
+class Journal:
+
+    def __init__(self, file):
+        self.file = file
+
+    def read(self):
+        """Yield (serial, raw ops) of every batch in the journal. Raise ValueError at a corrupt line."""
+        if not os.path.exists(self.file):
+            return
+        with open(self.file, encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    '''A batch still being written by another worker.'''
+                    break
+                if line.strip():
+                    try:
+                        batch = json.loads(line)
+                        serial, raw_ops = batch['serial'], batch['ops']
+                    except (ValueError, TypeError, KeyError):
+                        raise ValueError('Bad journal line: {0}'.format(line.strip()[:80]))
+                    yield serial, raw_ops
+
+    def append(self, serial, raw_ops):
+        line = json.dumps({'serial': serial, 'ops': raw_ops}, separators=(',', ':')) + '\n'
+        with open(self.file, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def read_delta_file(file):
+    raw_ops = []
+    with open(file) as f:
+        data = f.readlines()
+    for line in data:
+        line_list = line.strip().split()
+        if line_list:
+            raw_ops.append(line_list)
+    return raw_ops
+
+
+def send_request(address, request):
+    connection = socket.create_connection(address, timeout=30)
+    try:
+        connection.sendall(bytes(json.dumps(request, separators=(',', ':')), encoding='utf-8'))
+        connection.shutdown(socket.SHUT_WR)
+        return str(connection.recv(64 * 1024), encoding='utf-8')
+    finally:
+        connection.close()
+
+
+def ask_serial(address):
+    reply = codec.parse_response(bytes(send_request(address, {}), encoding='utf-8'))
+    if reply is None or not reply[2].isdigit():
+        raise ValueError('Bad serial reply from {0}:{1}'.format(address[0], address[1]))
+    return int(reply[2])
+
+
+def send_batch(address, key, serial, raw_ops):
+    return send_request(address, {'serial': serial, 'ops': raw_ops, 'mac': sign_batch(key, serial, raw_ops)})
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Send a batch of zone changes to a running TLS server.')
+    parser.add_argument('server_id', help='e.g. COM_DNS_Server')
+    parser.add_argument('delta', help='file of lines "add name ip", "delete name", "replace name ip"')
+    parser.add_argument('--serial', type=int, help='serial of this batch, default: the current serial + 1')
+    parser.add_argument('--update-file', default='./data/update.dat')
+    args = parser.parse_args(argv)
+
+    channel = read_update_file(args.update_file, args.server_id)
+    if channel is None:
+        print('{0} has no update channel in {1}'.format(args.server_id, args.update_file))
+        return 1
+    port, key = channel
+
+    serial = args.serial
+    if serial is None:
+        try:
+            serial = ask_serial(('127.0.0.1', port)) + 1
+        except ValueError as e:
+            print(e)
+            return 1
+
+    print(send_batch(('127.0.0.1', port), key, serial, read_delta_file(args.delta)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))